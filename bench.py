@@ -0,0 +1,6 @@
+import sys
+
+from internal import bench
+
+if __name__ == '__main__':
+    sys.exit(bench.main())
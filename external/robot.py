@@ -1,3 +1,5 @@
+from math import pi, inf
+
 import numpy as np
 
 class Robot:
@@ -23,10 +25,10 @@ class Robot:
         ('fwd', {'s': False, 'e': <error message>, 'd': <the distance actually moved>})
         If the value of 'e' is 'collision', another element 'c' exists, which
         describes the type of object that the robot is colliding with. This can
-        be 'rock', 'barrier', or 'edge'.
+        be 'rock', 'barrier', or 'edge', or 'robot' if there are several robots
+        on the field and another one is in the way.
         """
-        self.__driver.send_command('fwd', {'dist': distance})
-        return self.__driver.get_response(True)
+        return self.forward_async(distance).result()
 
     def turn(self, angle):
         """Turn a specific angle (in radians). This method blocks (waits) for
@@ -35,8 +37,7 @@ class Robot:
         This method always succeeds, and it returns the following:
         ('turn', {'s': True, 'd': <the angle you requested>})
         """
-        self.__driver.send_command('turn', {'angle': angle})
-        return self.__driver.get_response(True)
+        return self.turn_async(angle).result()
 
     def pick(self):
         """Attempt to pick up a rock. This method blocks (waits) for the operation
@@ -48,20 +49,102 @@ class Robot:
         This method returns the following data structure:
         ('pick', {'n': <how many rocks were picked up>})
         """
-        self.__driver.send_command('pick', {})
-        return self.__driver.get_response(True)
+        return self.pick_async().result()
+
+    def scan(self, rays=16, fov=2*pi, max_dist=None, angles=None):
+        """Measure the distance to the nearest obstacles, like a lidar. This
+        casts `rays` rays spread evenly over an arc of `fov` radians centered
+        on the robot's heading (the default is all the way around), or at the
+        given list of angles relative to the heading. Rays start at the center
+        of the robot, so something touching the robot head-on is about 20
+        units away. This is much cheaper than a screenshot.
+
+        Returns the following data structure:
+        ('scan', {'a': <array of the ray angles, relative to the heading>,
+                  'd': <array of the distance along each ray>,
+                  'c': <list of what each ray hit: 'rock', 'barrier', 'edge'
+                        or 'robot'>})
+        If max_dist is given, rays that don't hit anything within that
+        distance get a distance of inf and None for what they hit. 'robot'
+        only comes up when there are several robots on the field.
+        """
+        return self.scan_async(rays, fov, max_dist, angles).result()
+
+    def forward_async(self, distance):
+        """Like forward(), but returns straight away. The return value is a
+        concurrent.futures.Future; call its result() method to wait for the
+        response. To use it with asyncio, wrap it with asyncio.wrap_future().
+
+        Commands run in the order they are sent, so several can be queued up
+        at once; each one starts when the previous one is finished.
+        """
+        return self.__driver.submit('fwd', {'dist': distance})
+
+    def turn_async(self, angle):
+        """Like turn(), but returns a Future (see forward_async())."""
+        return self.__driver.submit('turn', {'angle': angle})
+
+    def pick_async(self):
+        """Like pick(), but returns a Future (see forward_async())."""
+        return self.__driver.submit('pick', {})
 
-    def request_screenshot(self):
+    def scan_async(self, rays=16, fov=2*pi, max_dist=None, angles=None):
+        """Like scan(), but returns a Future (see forward_async())."""
+        if angles is None:
+            angles = fov * (np.arange(rays) + 0.5) / rays - fov/2
+        return self.__driver.submit('scan', {
+            'angles': np.asarray(angles, dtype=float),
+            'max_dist': inf if max_dist is None else max_dist})
+
+    def batch(self, steps):
+        """Run a list of commands back-to-back, e.g. to follow a path, and
+        wait for all of them to finish. Each step is one of:
+        ('fwd', <distance>), ('turn', <angle>) or ('pick',)
+
+        This is faster than calling forward()/turn()/pick() one at a time,
+        because the robot starts each step as soon as the previous one is
+        done. Returns a list with the response for each step, in the same
+        format as the single commands. If the robot collides with something,
+        the remaining steps are not run, and their responses are
+        (<command>, {'s': False, 'e': 'aborted'}).
+        """
+        return self.batch_async(steps).result()
+
+    def batch_async(self, steps):
+        """Like batch(), but returns a Future (see forward_async())."""
+        cmds = []
+        for step in steps:
+            if step[0] == 'fwd':
+                cmds.append(('fwd', {'dist': step[1]}))
+            elif step[0] == 'turn':
+                cmds.append(('turn', {'angle': step[1]}))
+            elif step[0] == 'pick':
+                cmds.append(('pick', {}))
+            else:
+                raise ValueError("Invalid step: %r" % (step,))
+        return self.__driver.submit_batch(cmds)
+
+    def request_screenshot(self, roi=None, scale=1, copy=False):
         """Request an image of the field in OpenCV format.
 
         This function returns a 3-channel, 8-bit-per-channel image (type CV_8UC3)
         in RGB format. User code should convert this to BGR for compatibility
         with other OpenCV functions.
 
+        The image is the next frame that is drawn, so this can be called once
+        per frame. Optional arguments:
+        * roi: (x, y, width, height) - only return this part of the image
+        * scale: only keep every scale-th pixel in each direction (e.g. 2 for
+          a half-size image)
+        * copy: see below
+
+        To keep this fast, the image is not copied, and its contents will be
+        overwritten some time after the next call to request_screenshot(). If
+        you want to keep an image around for longer than that, pass copy=True
+        (or copy it yourself). Some OpenCV functions need a contiguous image;
+        use np.ascontiguousarray() if you use roi or scale with them.
+
         This method may cause issues if the display has a different color depth
         than 8 bits per channel.
-
-        This method is fairly inefficient, and should not be called many times
-        per second.
         """
-        return self.__driver.request_screenshot().transpose(1, 0, 2)
+        return self.__driver.request_screenshot(roi, scale, copy)
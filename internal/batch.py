@@ -0,0 +1,409 @@
+# Vectorized simulator that runs many fields at once, without pygame.
+#
+# Every field has the layout from internal.layout and its own random rocks.
+# Robots move exactly the way InternalRobot does (one `speed` step per tick,
+# stopping on the first tick that collides), but every field is stepped in
+# the same array operation.
+
+import threading
+from queue import Queue
+from concurrent.futures import Future
+from math import pi
+
+import numpy as np
+
+from internal import layout
+from internal.collision import ScreenCollider, raycast_boxes
+from external import robot as robot_ex
+
+MOVE_NONE    = 0
+MOVE_FORWARD = 1
+MOVE_TURN    = 2
+
+# what a forward move ran into. Earlier entries win if the robot hits several
+# things at once, which matches the order colliders are added in MainWindow.
+HIT_NONE    = 0
+HIT_EDGE    = 1
+HIT_BARRIER = 2
+HIT_ROCK    = 3
+HIT_NAMES   = (None, 'edge', 'barrier', 'rock')
+
+class BatchSim:
+    """N independent fields, stored as arrays.
+
+    Robot poses use the same representation as InternalRobot (position of the
+    last turn, distance moved since then, and heading). Rocks are (N, R)
+    arrays of centers and radii with an alive flag; the barriers are shared by
+    every field.
+
+    The move methods take an array of field indices. Moves are advanced for
+    all fields by step(), after which `done` marks the fields whose move
+    ended on that step, with `success`, `moved` and `hit` describing how.
+    """
+
+    def __init__(self, n, seed=None, n_rocks=layout.ROCK_COUNT, max_attempts=10000):
+        self.n = n
+        self.rng = np.random.default_rng(seed)
+        self.width  = layout.FIELD_WIDTH
+        self.height = layout.FIELD_HEIGHT
+        self.robot_radius = layout.ROBOT_RADIUS
+        self.speed = layout.ROBOT_SPEED
+        self.pick_radius = self.robot_radius * layout.PICK_SCALE
+        # columns: left, top, right, bottom
+        self.barriers = np.array(layout.BARRIERS, dtype=float).reshape(-1, 4)
+
+        sx, sy = layout.ROBOT_START
+        self.turn_x  = np.full(n, float(sx))
+        self.turn_y  = np.full(n, float(sy))
+        self.dist    = np.zeros(n)
+        self.heading = np.zeros(n)
+
+        self.move_type   = np.zeros(n, np.int8)
+        self.move_t      = np.zeros(n, np.int64) # ticks since the move started
+        self.move_start  = np.zeros(n)
+        self.move_target = np.zeros(n)
+        self.move_speed  = np.zeros(n)
+
+        self.done    = np.zeros(n, bool)
+        self.ended   = np.zeros(n, np.int8) # MOVE_* type of the move that ended
+        self.success = np.zeros(n, bool)
+        self.moved   = np.zeros(n)
+        self.hit     = np.zeros(n, np.int8)
+
+        self.ticks = 0
+        self.place_rocks(n_rocks, max_attempts)
+
+    def position(self, idx):
+        return (self.turn_x[idx] + self.dist[idx] * np.cos(self.heading[idx]),
+                self.turn_y[idx] + self.dist[idx] * np.sin(self.heading[idx]))
+
+    def box_hits(self, idx, x, y, half, robot=False):
+        """Test square boxes centered on (x, y) against fields idx. Returns
+        the HIT_* value of the first thing each box intersects. If robot is
+        True, the robot's start box counts as a barrier (used while placing
+        rocks).
+        """
+        l, r = x - half, x + half
+        t, b = y + half, y - half
+        edge = (r > self.width/2) | (l < -self.width/2) \
+             | (t > self.height/2) | (b < -self.height/2)
+
+        B = self.barriers
+        barrier = ((B[:, 2] > l[:, None]) & (B[:, 0] < r[:, None])
+                 & (B[:, 1] > b[:, None]) & (B[:, 3] < t[:, None])).any(axis=1)
+        if robot:
+            sx, sy = layout.ROBOT_START
+            rr = self.robot_radius
+            barrier |= (sx + rr > l) & (sx - rr < r) & (sy + rr > b) & (sy - rr < t)
+
+        rx, ry, rr = self.rock_x[idx], self.rock_y[idx], self.rock_r[idx]
+        rock = (self.rock_alive[idx]
+                & (rx + rr > l[:, None]) & (rx - rr < r[:, None])
+                & (ry + rr > b[:, None]) & (ry - rr < t[:, None])).any(axis=1)
+
+        return np.select([edge, barrier, rock], [HIT_EDGE, HIT_BARRIER, HIT_ROCK],
+                         HIT_NONE).astype(np.int8)
+
+    def place_rocks(self, n_rocks, max_attempts=10000):
+        """Scatter rocks like placement.place_uniform() (MainWindow with
+        rock_placement='uniform'): uniformly random integer positions,
+        rejected if they hit anything placed before them. The layouts are
+        drawn from numpy's generator, so they don't match a window's.
+        """
+        n = self.n
+        self.rock_r = self.rng.choice(layout.ROCK_RADII, size=(n, n_rocks)).astype(float)
+        self.rock_x = np.zeros((n, n_rocks))
+        self.rock_y = np.zeros((n, n_rocks))
+        self.rock_alive = np.zeros((n, n_rocks), bool)
+        for i in range(n_rocks):
+            todo = np.arange(n)
+            for attempt in range(max_attempts):
+                x = np.trunc(self.rng.random(len(todo)) * self.width - self.width/2)
+                y = np.trunc(self.rng.random(len(todo)) * self.height - self.height/2)
+                ok = self.box_hits(todo, x, y, self.rock_r[todo, i], True) == HIT_NONE
+                self.rock_x[todo[ok], i] = x[ok]
+                self.rock_y[todo[ok], i] = y[ok]
+                self.rock_alive[todo[ok], i] = True
+                todo = todo[~ok]
+                if len(todo) == 0:
+                    break
+            else:
+                raise ValueError("Can't place rock %d in %d field(s)" % (i, len(todo)))
+
+    def rocks_left(self):
+        return self.rock_alive.sum(axis=1)
+
+    def forward(self, idx, distance):
+        """Start forward moves. Returns a mask of the fields that accepted
+        (robots that are already moving don't).
+        """
+        idx = np.asarray(idx)
+        ok = self.move_type[idx] == MOVE_NONE
+        idx, distance = idx[ok], np.broadcast_to(distance, ok.shape)[ok]
+        self.move_type[idx] = MOVE_FORWARD
+        self.move_t[idx] = 0
+        self.move_start[idx] = self.dist[idx]
+        self.move_target[idx] = self.dist[idx] + distance
+        self.move_speed[idx] = self.speed
+        return ok
+
+    def turn(self, idx, angle):
+        idx = np.asarray(idx)
+        ok = self.move_type[idx] == MOVE_NONE
+        idx, angle = idx[ok], np.broadcast_to(angle, ok.shape)[ok]
+        self.move_type[idx] = MOVE_TURN
+        self.move_t[idx] = 0
+        self.move_start[idx] = self.heading[idx]
+        self.move_target[idx] = self.heading[idx] + angle
+        self.move_speed[idx] = self.speed / (pi * self.robot_radius)
+        self.turn_x[idx], self.turn_y[idx] = self.position(idx)
+        self.dist[idx] = 0
+        return ok
+
+    def pick(self, idx):
+        """Pick up every rock in range. Returns the number of rocks picked up
+        in each field (always 0 for robots that are moving).
+        """
+        idx = np.asarray(idx)
+        idx = idx[self.move_type[idx] == MOVE_NONE]
+        x, y = self.position(idx)
+        d = np.hypot(self.rock_x[idx] - x[:, None], self.rock_y[idx] - y[:, None])
+        picked = self.rock_alive[idx] & (d < self.pick_radius + self.rock_r[idx] * layout.ROCK_PICK_SCALE)
+        self.rock_alive[idx] &= ~picked
+        n = np.zeros(self.n, np.int64)
+        n[idx] = picked.sum(axis=1)
+        return n
+
+    def scan(self, i, angles, max_dist=np.inf):
+        """Raycast from the robot in field i, like InternalRobot.scan(). Returns
+        the distances and the HIT_* value of what each ray hit.
+        """
+        x, y = self.position(i)
+        a = self.heading[i] + np.asarray(angles, dtype=float)
+        dx, dy = np.cos(a), np.sin(a)
+        alive = self.rock_alive[i]
+        rx, ry, rr = self.rock_x[i][alive], self.rock_y[i][alive], self.rock_r[i][alive]
+        bounds = np.concatenate([self.barriers[:, [0, 3, 2, 1]],
+                                 np.stack([rx - rr, ry - rr, rx + rr, ry + rr], axis=1)])
+        dist, index = raycast_boxes(bounds, x, y, dx, dy)
+        hit = np.where(index < 0, HIT_NONE,
+                       np.where(index < len(self.barriers), HIT_BARRIER, HIT_ROCK))
+        edge, _ = ScreenCollider(self.width, self.height).raycast(x, y, dx, dy)
+        hit[edge < dist] = HIT_EDGE
+        dist = np.minimum(dist, edge)
+        hit[dist > max_dist] = HIT_NONE
+        dist[dist > max_dist] = np.inf
+        return dist, hit.astype(np.int8)
+
+    def step(self):
+        """Advance every in-flight move by one tick."""
+        self.done[:] = False
+        active = np.flatnonzero(self.move_type != MOVE_NONE)
+
+        fwd = active[self.move_type[active] == MOVE_FORWARD]
+        if len(fwd):
+            d0, tgt = self.move_start[fwd], self.move_target[fwd]
+            d = d0 + self.move_speed[fwd] * self.move_t[fwd]
+            x = self.turn_x[fwd] + d * np.cos(self.heading[fwd])
+            y = self.turn_y[fwd] + d * np.sin(self.heading[fwd])
+            hit = self.box_hits(fwd, x, y, np.full(len(fwd), float(self.robot_radius)))
+            clear = hit == HIT_NONE
+            reached = clear & np.where(tgt >= d0, d >= tgt, d <= tgt)
+            # a collision leaves the robot where it was on the previous tick
+            self.dist[fwd[clear]] = np.where(reached, tgt, d)[clear]
+            ended = ~clear | reached
+            self.finish(fwd[ended], reached[ended], self.dist[fwd[ended]] - d0[ended], hit[ended])
+
+        trn = active[self.move_type[active] == MOVE_TURN]
+        if len(trn):
+            h0, tgt = self.move_start[trn], self.move_target[trn]
+            h = h0 + self.move_speed[trn] * self.move_t[trn]
+            reached = np.where(tgt >= h0, h >= tgt, h <= tgt)
+            self.heading[trn] = np.where(reached, tgt, h)
+            self.finish(trn[reached], True, self.heading[trn[reached]] - h0[reached], HIT_NONE)
+
+        self.move_t[active] += 1
+        self.ticks += 1
+
+    def finish(self, idx, success, moved, hit):
+        self.ended[idx] = self.move_type[idx]
+        self.move_type[idx] = MOVE_NONE
+        self.done[idx] = True
+        self.success[idx] = success
+        self.moved[idx] = moved
+        self.hit[idx] = hit
+
+    def run(self, robot_fn, max_ticks=None, think_timeout=1.0):
+        """Run robot_fn against every field, each on its own thread, through
+        an external.robot.Robot.
+
+        The fields run in lockstep: a tick is only simulated once every
+        controller that has been given a response has sent its next command
+        or returned, so results don't depend on thread scheduling. If that
+        takes longer than think_timeout seconds, the simulation carries on
+        anyway.
+
+        Nothing is drawn, so controllers that take screenshots aren't
+        supported: Robot.request_screenshot() raises RuntimeError. Scans
+        work as usual.
+
+        Returns a list with a dict for every field: 'cleared' (the tick at
+        which the last rock was picked up, or None), 'rocks_left', 'error'
+        (the exception raised by the controller, if any) and 'collisions' by
+        type.
+        """
+        self.cond = threading.Condition()
+        self.pending = [] # (driver, cmd, params, future) waiting to run
+        self.owed = 0     # controllers that still owe us a command
+        drivers = [BatchDriver(self, i) for i in range(self.n)]
+        results = [{'cleared': None, 'error': None,
+                    'collisions': {'rock': 0, 'barrier': 0, 'edge': 0}}
+                   for i in range(self.n)]
+
+        def thread_fn(driver):
+            try:
+                robot_fn(robot_ex.Robot(driver))
+            except Exception as e:
+                results[driver.index]['error'] = e
+            finally:
+                with self.cond:
+                    driver.finished = True
+                    driver.set_owes(False)
+                    self.cond.notify_all()
+
+        for d in drivers:
+            d.set_owes(True)
+            d.thread = threading.Thread(target=thread_fn, args=(d,), daemon=True)
+            d.thread.start()
+
+        while max_ticks is None or self.ticks < max_ticks:
+            with self.cond:
+                self.cond.wait_for(lambda: self.owed == 0, think_timeout)
+                pending, self.pending = self.pending, []
+
+            # commands for robots that are still moving wait for a later tick
+            waiting = []
+            for d, cmd, payload, future in pending:
+                i = [d.index]
+                if self.move_type[d.index] != MOVE_NONE:
+                    waiting.append((d, cmd, payload, future))
+                elif cmd == 'fwd':
+                    self.forward(i, payload['dist'])
+                    d.moves.append(future)
+                elif cmd == 'turn':
+                    self.turn(i, payload['angle'])
+                    d.moves.append(future)
+                elif cmd == 'pick':
+                    n = int(self.pick(i)[d.index])
+                    if n and not self.rock_alive[d.index].any():
+                        results[d.index]['cleared'] = self.ticks
+                    d.respond(future, ('pick', {'n': n}))
+                elif cmd == 'scan':
+                    dist, hit = self.scan(d.index, payload['angles'], payload['max_dist'])
+                    d.respond(future, ('scan', {'a': payload['angles'], 'd': dist,
+                                                'c': [HIT_NAMES[h] for h in hit]}))
+                else:
+                    d.respond(future, exception=ValueError("Invalid command: %s" % cmd))
+            if waiting:
+                with self.cond:
+                    self.pending[:0] = waiting
+
+            if all(r['cleared'] is not None or d.finished
+                   for r, d in zip(results, drivers)) \
+                    and not (self.move_type != MOVE_NONE).any():
+                break
+
+            self.step()
+            for i in np.flatnonzero(self.done):
+                if self.ended[i] == MOVE_TURN:
+                    resp = ('turn', {'s': True, 'd': self.moved[i].item()})
+                else:
+                    resp = {'s': bool(self.success[i]), 'd': self.moved[i].item()}
+                    if self.hit[i] != HIT_NONE:
+                        resp['e'] = 'collision'
+                        resp['c'] = HIT_NAMES[self.hit[i]]
+                        results[i]['collisions'][resp['c']] += 1
+                    resp = ('fwd', resp)
+                drivers[i].respond(drivers[i].moves.pop(0), resp)
+
+        left = self.rocks_left()
+        for i, r in enumerate(results):
+            r['rocks_left'] = int(left[i])
+        return results
+
+class BatchDriver:
+    """Stands in for internal.driver.Driver for one field of a BatchSim, so
+    that external.robot.Robot can drive it.
+    """
+    def __init__(self, sim, index):
+        self.sim = sim
+        self.index = index
+        self.resp_queue = Queue()
+        self.thread = None
+        self.finished = False
+        # commands that haven't been answered yet
+        self.outstanding = 0
+        # futures for the moves that have been started
+        self.moves = []
+        # whether the simulation is waiting for this controller's next command
+        self.owes = False
+
+    def set_owes(self, owes):
+        # call with sim.cond held
+        if owes != self.owes:
+            self.owes = owes
+            self.sim.owed += 1 if owes else -1
+
+    def respond(self, future, resp=None, exception=None):
+        with self.sim.cond:
+            self.outstanding -= 1
+            if self.outstanding == 0 and not self.finished:
+                self.set_owes(True)
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(resp)
+
+    def submit(self, cmd, params):
+        future = Future()
+        with self.sim.cond:
+            self.sim.pending.append((self, cmd, params, future))
+            self.outstanding += 1
+            self.set_owes(False)
+            self.sim.cond.notify_all()
+        return future
+
+    def submit_batch(self, steps):
+        """Like Driver.submit_batch(), except that each step starts on the
+        tick after the previous one ended.
+        """
+        steps = list(steps)
+        future = Future()
+        results = []
+        def next_step(f=None):
+            if f is not None:
+                resp = f.result()
+                results.append(resp)
+                if resp[0] == 'fwd' and not resp[1]['s']:
+                    for cmd, params in steps[len(results):]:
+                        results.append((cmd, {'s': False, 'e': 'aborted'}))
+            if len(results) == len(steps):
+                future.set_result(results)
+            else:
+                self.submit(*steps[len(results)]).add_done_callback(next_step)
+        next_step()
+        return future
+
+    def send_command(self, cmd, params):
+        # the Future itself is queued, so that get_response() can raise its
+        # error (e.g. for an invalid command) in the controller's thread
+        self.submit(cmd, params).add_done_callback(self.resp_queue.put)
+
+    def get_response(self, wait=False):
+        if not self.resp_queue.empty() or wait:
+            return self.resp_queue.get().result()
+        return None
+
+    def request_screenshot(self, roi=None, scale=1, copy=False):
+        # nothing is ever drawn, so there is nothing to take a picture of
+        raise RuntimeError("the batch simulator has no screen")
@@ -0,0 +1,248 @@
+# Benchmarks for the simulator's hot paths.
+#
+# Everything runs headless (SDL's dummy video driver), and results are printed
+# as one JSON object per line. Times are seconds per call (median over several
+# repeats). Results can be saved as a baseline and later runs compared to it.
+
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import json
+import random
+import statistics
+import sys
+import threading
+import time
+
+import numpy as np
+import pygame
+
+from internal import layout, placement, version
+from internal.collision import *
+from internal.world import World, KIND_ROCK
+
+BASELINE = 'bench_baseline.json'
+
+def measure(fn, repeat=5, min_time=0.1):
+    """Time fn() like timeit: find a number of calls that takes at least
+    min_time, then return the median and best time per call over repeat
+    runs of that many calls.
+    """
+    number = 1
+    while True:
+        t0 = time.perf_counter()
+        for i in range(number):
+            fn()
+        elapsed = time.perf_counter() - t0
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed == 0 else max(2, min(10, int(min_time / elapsed * 1.2)))
+    times = [elapsed / number]
+    for i in range(repeat - 1):
+        t0 = time.perf_counter()
+        for i in range(number):
+            fn()
+        times.append((time.perf_counter() - t0) / number)
+    return {'median': statistics.median(times), 'min': min(times), 'calls': number}
+
+def field_obstacles(cls):
+    c = cls()
+    c.add_collider(ScreenCollider(layout.FIELD_WIDTH, layout.FIELD_HEIGHT))
+    for l, t, r, b in layout.BARRIERS:
+        c.add_collider(aabb_from_corners(l, t, r, b))
+    return c
+
+def random_boxes(rng, n, half_size=340):
+    return [AABB(2*r, 2*r, rng.randint(-half_size, half_size), rng.randint(-half_size, half_size))
+            for r in (rng.choice(layout.ROCK_RADII) for i in range(n))]
+
+def bench_collision():
+    rng = random.Random(1)
+    a, b = AABB(40, 40, 0, 0), AABB(24, 24, 10, 10)
+    yield 'aabb_test', measure(lambda: a.test(b))
+    for n in (10, 100, 1000, 10000):
+        # a field that grows with n, with about as many rocks per area as a
+        # normal one has at n=100
+        half_size = int(360 * max(1, n / 100) ** 0.5)
+        boxes = random_boxes(rng, n, half_size)
+        queries = random_boxes(rng, 64, half_size)
+        for name, cls in (('linear', CollisionSet), ('grid', GridCollisionSet), ('world', World)):
+            c = cls()
+            for box in boxes:
+                if cls is World:
+                    c.add(box.width, box.height, box.x, box.y, KIND_ROCK)
+                else:
+                    c.add_collider(box)
+            result = measure(lambda: [c.test(q) for q in queries], repeat=3)
+            # per query
+            result['median'] /= len(queries)
+            result['min'] /= len(queries)
+            yield 'collision_set_test[%s,%d]' % (name, n), result
+
+def idle_controller(robot):
+    pass
+
+def make_window(seed=1, rock_count=layout.ROCK_COUNT, robot_fn=idle_controller):
+    from internal import window
+    return window.MainWindow(robot_fn, True, seed=seed, rock_count=rock_count)
+
+def bench_pick():
+    for n in (24, 100):
+        win = make_window(rock_count=n)
+        yield 'robot_pick[%d]' % n, measure(win.robot.pick)
+        # a test against the window's own collision set
+        yield 'robot_collides[%d]' % n, measure(win.robot.collides)
+        angles = np.linspace(-np.pi, np.pi, 32, endpoint=False)
+        yield 'robot_scan[%d]' % n, measure(lambda: win.robot.scan(angles))
+
+def bench_placement():
+    # 250 rocks is more than place_uniform() can fit
+    for n in (24, 100, 250):
+        rng = random.Random(2)
+        radii = [rng.choice(layout.ROCK_RADII) for i in range(n)]
+        obstacles = field_obstacles(GridCollisionSet)
+        obstacles.add_collider(AABB(2*layout.ROBOT_RADIUS, 2*layout.ROBOT_RADIUS, *layout.ROBOT_START))
+        for name in ('poisson', 'uniform') if n <= 100 else ('poisson',):
+            fn = getattr(placement, 'place_' + name)
+            yield 'place_%s[%d]' % (name, n), measure(lambda: fn(
+                    random.Random(3), radii, obstacles, layout.FIELD_WIDTH, layout.FIELD_HEIGHT),
+                    repeat=3)
+    yield 'window_init', measure(make_window, repeat=3)
+    # without any rock sprites generated yet
+    from internal import sprites
+    def cold():
+        sprites.rock_atlas = sprites.RockAtlas()
+        make_window()
+    yield 'window_init_cold', measure(cold, repeat=3)
+
+def bench_render():
+    win = make_window()
+    flags = win.DRAW_DISABLE_BARRIERS | win.DRAW_DISABLE_FLIP
+    def full():
+        win.scene = None
+        win.draw(flags)
+    yield 'render_full', measure(full)
+    win.draw(flags)
+    yield 'render_dirty', measure(lambda: win.draw(flags))
+
+def bench_screenshot():
+    win = make_window()
+    win.draw(win.DRAW_DISABLE_BARRIERS | win.DRAW_DISABLE_FLIP)
+    yield 'screenshot_capture', measure(lambda: win.driver.frames.capture(win.screen))
+
+    # round trip through Driver.request_screenshot, with the simulation
+    # running on another thread
+    stop = []
+    def loop():
+        while not stop:
+            win.update(win.DRAW_DISABLE_BARRIERS)
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    try:
+        yield 'screenshot_request', measure(win.driver.request_screenshot, repeat=3)
+    finally:
+        stop.append(True)
+        thread.join()
+
+def canned_controller(robot):
+    # wander around the field, picking up whatever is nearby
+    for i in range(150):
+        robot.batch([('fwd', 90), ('pick',)])
+        robot.batch([('turn', 2.5 if i % 3 else 1.2), ('pick',)])
+
+def bench_end_to_end():
+    times, ticks, left = [], [], []
+    for i in range(3):
+        win = make_window(seed=5, robot_fn=canned_controller)
+        win.start()
+        result = win.run(max_ticks=500000, timeout=60, stop_on_return=True)
+        times.append(result['wall_time'])
+        ticks.append(result['ticks'])
+        left.append(result['rocks_left'])
+    yield 'end_to_end', {'median': statistics.median(times), 'min': min(times),
+                         'calls': 1, 'ticks': statistics.median(ticks),
+                         'rocks_left': statistics.median(left)}
+
+def bench_robots():
+    # cost of a tick with several robots driving around the field
+    for n in (1, 4, 16):
+        win = make_window(seed=5, robot_fn=[canned_controller] * n)
+        win.start()
+        t0 = time.perf_counter()
+        ticks = 0
+        while ticks < 2000:
+            win.tick()
+            ticks += 1
+        elapsed = time.perf_counter() - t0
+        yield 'robots_tick[%d]' % n, {'median': elapsed / ticks, 'min': elapsed / ticks,
+                                      'calls': ticks}
+
+SUITES = {
+    'collision': bench_collision,
+    'pick': bench_pick,
+    'placement': bench_placement,
+    'render': bench_render,
+    'screenshot': bench_screenshot,
+    'end_to_end': bench_end_to_end,
+    'robots': bench_robots,
+}
+
+def run(suites=None, out=sys.stdout):
+    pygame.display.init()
+    results = {}
+    for suite in suites or SUITES:
+        for name, result in SUITES[suite]():
+            result = dict(name=name, **result)
+            results[name] = result
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+    return results
+
+def compare(results, baseline, threshold):
+    """Print how results compare to a baseline. Returns the names of the
+    benchmarks that got slower by more than threshold (e.g. 0.1 for 10%).
+    """
+    slower = []
+    print("%-36s %12s %12s %8s" % ('benchmark', 'baseline', 'now', 'change'), file=sys.stderr)
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print("%-36s %12s %12.3g %8s" % (name, '-', result['median'], 'new'), file=sys.stderr)
+            continue
+        change = result['median'] / base['median'] - 1
+        mark = ''
+        if change > threshold:
+            slower.append(name)
+            mark = ' SLOWER'
+        print("%-36s %12.3g %12.3g %+7.1f%%%s" %
+              (name, base['median'], result['median'], change * 100, mark), file=sys.stderr)
+    return slower
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark the simulator")
+    parser.add_argument('suites', nargs='*',
+                        help="suites to run: %s (default: all)" % ', '.join(SUITES))
+    parser.add_argument('--baseline', default=BASELINE,
+                        help="baseline file to compare with (default %s)" % BASELINE)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="save the results as the new baseline")
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help="relative slowdown reported as a regression (default 0.15)")
+    args = parser.parse_args(argv)
+    for suite in args.suites:
+        if suite not in SUITES:
+            parser.error("unknown suite: %s" % suite)
+
+    results = run(args.suites)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'version': version.VERSION, 'results': results}, f, indent=2)
+        print("Baseline saved to %s" % args.baseline, file=sys.stderr)
+        return 0
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
@@ -1,9 +1,12 @@
 # brain-dead axis-aligned collision thing
 
 from math import *
+import numpy as np
 import pygame
 
 class Collider:
+    __slots__ = ('info', 'parent')
+
     def __init__(self):
         self.info = {}
         self.parent = None
@@ -18,10 +21,42 @@ class Collider:
         """
         return None
 
+    def test_all(self, other):
+        """Like test(), but returns a list of every intersecting collider
+        instead of only the first one.
+        """
+        colliding = self.test(other)
+        return [] if colliding is None else [colliding]
+
+    def sweep(self, aabb, dx, dy, dist):
+        """Sweep an AABB along the unit direction (dx, dy). Returns the
+        distance along the path (0 <= s <= dist) at which it starts to
+        intersect this collider, or None if it doesn't within dist. The box
+        itself is not moved.
+        """
+        return None
+
+    def raycast(self, ox, oy, dx, dy):
+        """Cast rays from (ox, oy) along the unit directions given by the
+        arrays dx and dy. Returns an array with the distance along each ray
+        at which it first hits this collider (inf if it doesn't), and a list
+        of the colliders that were hit (None for a miss).
+        """
+        return np.full(len(dx), inf), [None] * len(dx)
+
+    def boxes(self):
+        """If this collider is nothing but AABBs, the colliders to report for
+        them and an (N, 4) array of their (l, b, r, t) bounds, so that
+        CollisionSet.raycast() can test them all at once. None otherwise.
+        """
+        return None
+
     def draw(self, surf, x0, y0):
         pass
 
 class AABB(Collider):
+    __slots__ = ('width', 'height', 'x', 'y')
+
     def __init__(self, w, h, x=0, y=0):
         super().__init__()
         self.width = w
@@ -59,6 +94,34 @@ class AABB(Collider):
             return self
         return None
 
+    def sweep(self, aabb, dx, dy, dist):
+        # interval of s where the boxes overlap on each axis
+        enter, leave = 0, inf
+        for d, lo, hi in ((dx, self.l() - aabb.r(), self.r() - aabb.l()),
+                          (dy, self.b() - aabb.t(), self.t() - aabb.b())):
+            if d == 0:
+                if lo >= 0 or hi <= 0:
+                    return None
+                continue
+            s0, s1 = lo / d, hi / d
+            if s0 > s1:
+                s0, s1 = s1, s0
+            enter = max(enter, s0)
+            leave = min(leave, s1)
+        if enter >= leave or enter > dist:
+            return None
+        return enter
+
+    def bounds(self):
+        return (self.l(), self.b(), self.r(), self.t())
+
+    def boxes(self):
+        return [self], np.array([self.bounds()], dtype=float)
+
+    def raycast(self, ox, oy, dx, dy):
+        dist, index = raycast_boxes(self.boxes()[1], ox, oy, dx, dy)
+        return dist, [self if i >= 0 else None for i in index]
+
     def draw(self, surf, x0, y0):
         rect = pygame.Rect(x0 + self.l(), y0 - self.t(), self.width, self.height)
         pygame.draw.rect(surf, (0xff, 0x00, 0x00), rect, 1)
@@ -66,6 +129,58 @@ class AABB(Collider):
 def aabb_from_corners(l, t, r, b):
     return AABB(r-l, t-b, (r+l)/2, (t+b)/2)
 
+def raycast_boxes(bounds, ox, oy, dx, dy):
+    """Cast rays from (ox, oy) along the unit directions in the arrays dx and
+    dy against an (N, 4) array of boxes, one (l, b, r, t) row per box, all at
+    once. Returns the distance along each ray to the first box it hits (inf
+    if none) and the index of that box (-1 if none). A ray that starts inside
+    a box hits it at distance 0; one that only grazes an edge misses.
+    """
+    n = len(dx)
+    if len(bounds) == 0:
+        return np.full(n, inf), np.full(n, -1)
+    # rays parallel to an axis would divide by zero
+    inv_x = 1 / np.where(dx == 0, 1e-12, dx)[:, None]
+    inv_y = 1 / np.where(dy == 0, 1e-12, dy)[:, None]
+    tx0, tx1 = (bounds[:, 0] - ox) * inv_x, (bounds[:, 2] - ox) * inv_x
+    ty0, ty1 = (bounds[:, 1] - oy) * inv_y, (bounds[:, 3] - oy) * inv_y
+    enter = np.maximum(np.maximum(np.minimum(tx0, tx1), np.minimum(ty0, ty1)), 0)
+    leave = np.minimum(np.maximum(tx0, tx1), np.maximum(ty0, ty1))
+    enter[leave <= enter] = inf
+    index = enter.argmin(axis=1)
+    dist = enter[np.arange(n), index]
+    index[dist == inf] = -1
+    return dist, index
+
+def sweep_boxes(bounds, aabb, dx, dy, dist):
+    """AABB.sweep() against an (N, 4) array of (l, b, r, t) boxes at once.
+    Returns the distance at which aabb first touches any of them, or None.
+    """
+    enter = np.zeros(len(bounds))
+    leave = np.full(len(bounds), inf)
+    for d, lo, hi in ((dx, bounds[:, 0] - aabb.r(), bounds[:, 2] - aabb.l()),
+                      (dy, bounds[:, 1] - aabb.t(), bounds[:, 3] - aabb.b())):
+        if d == 0:
+            enter[(lo >= 0) | (hi <= 0)] = inf
+            continue
+        s0, s1 = lo / d, hi / d
+        enter = np.maximum(enter, np.minimum(s0, s1))
+        leave = np.minimum(leave, np.maximum(s0, s1))
+    enter = enter[(enter < leave) & (enter <= dist)]
+    if len(enter) == 0:
+        return None
+    return float(enter.min())
+
+def sweep_colliders(colliders, aabb, dx, dy, dist):
+    """Earliest sweep() distance over several colliders, or None."""
+    first = None
+    for collider in colliders:
+        s = collider.sweep(aabb, dx, dy, dist)
+        if s is not None and (first is None or s < first):
+            first = s
+            dist = s
+    return first
+
 class ScreenCollider(Collider):
     def __init__(self, screen_width, screen_height):
         super().__init__()
@@ -81,31 +196,203 @@ class ScreenCollider(Collider):
             return self
         return None
 
+    def sweep(self, other, dx, dy, dist):
+        if self.test(other) is not None:
+            return 0
+        # distance at which the box leaves the screen
+        leave = inf
+        for d, lo, hi in ((dx, -self.w/2 - other.l(), self.w/2 - other.r()),
+                          (dy, -self.h/2 - other.b(), self.h/2 - other.t())):
+            if d > 0:
+                leave = min(leave, hi / d)
+            elif d < 0:
+                leave = min(leave, lo / d)
+        if leave > dist:
+            return None
+        return leave
+
+    def raycast(self, ox, oy, dx, dy):
+        w, h = self.w/2, self.h/2
+        if abs(ox) > w or abs(oy) > h:
+            dist = np.zeros(len(dx))
+        else:
+            # distance at which each ray leaves the screen
+            dx = np.where(dx == 0, 1e-12, dx)
+            dy = np.where(dy == 0, 1e-12, dy)
+            dist = np.minimum(np.where(dx > 0, w - ox, -w - ox) / dx,
+                              np.where(dy > 0, h - oy, -h - oy) / dy)
+        return dist, [self] * len(dx)
+
 
 class CollisionSet(Collider):
     def __init__(self):
         super().__init__()
         self.colliders = []
+        # AABBs as arrays for raycast(); rebuilt when the set changes
+        self.box_cache = None
 
     def add_collider(self, collider):
         # technically colliders can have multiple parents
         # Please don't do this, though
         collider.parent = self
         self.colliders.append(collider)
+        self.box_cache = None
 
     def remove_collider(self, collider):
         if collider in self.colliders:
             collider.parent = None
             self.colliders.remove(collider)
+            self.box_cache = None
 
     def test(self, aabb):
-        # could be optimized using quadtrees but I don't really care at this point
+        # linear scan; see GridCollisionSet for large sets
         for collider in self.colliders:
             colliding = collider.test(aabb)
             if colliding is not None:
                 return colliding
         return None
 
+    def test_all(self, aabb):
+        hits = []
+        for collider in self.colliders:
+            hits.extend(collider.test_all(aabb))
+        return hits
+
+    def sweep(self, aabb, dx, dy, dist):
+        return sweep_colliders(self.colliders, aabb, dx, dy, dist)
+
+    def raycast(self, ox, oy, dx, dy):
+        if self.box_cache is None:
+            boxes, others, bounds = [], [], [np.zeros((0, 4))]
+            for collider in self.colliders:
+                b = collider.boxes()
+                if b is None:
+                    others.append(collider)
+                else:
+                    boxes.extend(b[0])
+                    bounds.append(b[1])
+            self.box_cache = (boxes, others, np.concatenate(bounds))
+        boxes, others, bounds = self.box_cache
+
+        dist, index = raycast_boxes(bounds, ox, oy, dx, dy)
+        hits = [boxes[i] if i >= 0 else None for i in index]
+        for collider in others:
+            d, h = collider.raycast(ox, oy, dx, dy)
+            for i in np.flatnonzero(d < dist):
+                hits[i] = h[i]
+            dist = np.minimum(dist, d)
+        return dist, hits
+
     def draw(self, surf, x0, y0):
         for collider in self.colliders:
             collider.draw(surf, x0, y0)
+
+class GridCollisionSet(CollisionSet):
+    """A CollisionSet backed by a uniform grid.
+
+    Each AABB is stored in every grid cell that it overlaps, so a test only
+    has to look at colliders near the box being tested. Anything that isn't an
+    AABB (the screen edges, nested sets) has no useful bounds and is tested
+    every time. test() returns the same collider that a plain CollisionSet
+    would, i.e. the first intersecting one in the order they were added.
+
+    AABBs must not be moved while they are in the set; remove them, move them
+    and add them again instead.
+    """
+    def __init__(self, cell_size=64):
+        super().__init__()
+        self.cell_size = cell_size
+        self.cells = {}
+        self.unbounded = []
+        # insertion order of each collider, keyed by id()
+        self.order = {}
+        self.next_order = 0
+
+    def cell_range(self, aabb):
+        cs = self.cell_size
+        return (range(floor(aabb.l() / cs), floor(aabb.r() / cs) + 1),
+                range(floor(aabb.b() / cs), floor(aabb.t() / cs) + 1))
+
+    def add_collider(self, collider):
+        super().add_collider(collider)
+        self.order[id(collider)] = self.next_order
+        self.next_order += 1
+        if isinstance(collider, AABB):
+            xs, ys = self.cell_range(collider)
+            for i in xs:
+                for j in ys:
+                    self.cells.setdefault((i, j), []).append(collider)
+        else:
+            self.unbounded.append(collider)
+
+    def remove_collider(self, collider):
+        if collider not in self.colliders:
+            return
+        super().remove_collider(collider)
+        del self.order[id(collider)]
+        if isinstance(collider, AABB):
+            xs, ys = self.cell_range(collider)
+            for i in xs:
+                for j in ys:
+                    cell = self.cells[(i, j)]
+                    cell.remove(collider)
+                    if len(cell) == 0:
+                        del self.cells[(i, j)]
+        else:
+            self.unbounded.remove(collider)
+
+    def candidates(self, aabb):
+        """Colliders that might intersect aabb, in no particular order."""
+        found = {}
+        for c in self.unbounded:
+            found[id(c)] = c
+        xs, ys = self.cell_range(aabb)
+        for i in xs:
+            for j in ys:
+                for c in self.cells.get((i, j), ()):
+                    found[id(c)] = c
+        return found.values()
+
+    def test(self, aabb):
+        # the hit that was added first wins, as in a linear scan
+        order = self.order
+        first = None
+        first_order = None
+        for collider in self.candidates(aabb):
+            o = order[id(collider)]
+            if first_order is not None and o > first_order:
+                continue
+            colliding = collider.test(aabb)
+            if colliding is not None:
+                first = colliding
+                first_order = o
+        return first
+
+    def test_all(self, aabb):
+        order = self.order
+        hits = []
+        for collider in sorted(self.candidates(aabb), key=lambda c: order[id(c)]):
+            hits.extend(collider.test_all(aabb))
+        return hits
+
+    def sweep(self, aabb, dx, dy, dist):
+        # The unbounded colliders (normally the screen edges) usually put a
+        # limit on how far the box can go, which keeps the grid query small.
+        first = sweep_colliders(self.unbounded, aabb, dx, dy, dist)
+        if first is not None:
+            dist = first
+        if dist == inf:
+            return sweep_colliders(self.colliders, aabb, dx, dy, dist)
+        ex, ey = aabb.x + dx * dist, aabb.y + dy * dist
+        swept = aabb_from_corners(min(aabb.l(), ex - aabb.width/2),
+                                  max(aabb.t(), ey + aabb.height/2),
+                                  max(aabb.r(), ex + aabb.width/2),
+                                  min(aabb.b(), ey - aabb.height/2))
+        xs, ys = self.cell_range(swept)
+        found = {}
+        for i in xs:
+            for j in ys:
+                for c in self.cells.get((i, j), ()):
+                    found[id(c)] = c
+        s = sweep_colliders(found.values(), aabb, dx, dy, dist)
+        return first if s is None else s
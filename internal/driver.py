@@ -1,77 +1,225 @@
-from threading import Thread
-from queue import Queue
-from pygame import surfarray
-import time
+from threading import Thread, Event
+from queue import Queue, Empty
+from concurrent.futures import Future
 
 from internal.collision import *
+from internal.frames import FrameStore
+from internal.stats import Stats
+
+def collider_type(collider):
+    """What the robot reports running into: 'rock', 'robot', 'edge' or
+    'barrier'.
+    """
+    if 'rock' in collider.info:
+        return 'rock'
+    elif 'robot' in collider.info:
+        return 'robot'
+    elif isinstance(collider, ScreenCollider):
+        return 'edge'
+    return 'barrier'
 
 class Driver:
-    def __init__(self, robot, screen, thread_fn, args=()):
+    """Connects a controller thread to the simulated robot.
+
+    Commands are ('fwd', {'dist': ...}), ('turn', {'angle': ...}),
+    ('pick', {}) or ('scan', {'angles': [...], 'max_dist': ...}). submit()
+    queues one and returns a Future for its response; submit_batch() queues
+    a list of them that run back-to-back. Commands run in the order they
+    were submitted, as soon as the robot is free, from update() on the
+    simulation thread.
+    """
+    def __init__(self, robot, screen, thread_fn, args=(), stats=None, wakeup=None):
         self.robot = robot
-        self.cmd_queue = Queue(2)
-        self.resp_queue = Queue(2)
+        self.stats = stats if stats is not None else Stats(enabled=False)
+        # jobs waiting to run: (steps, future, is_batch)
+        self.cmd_queue = Queue()
+        # responses for send_command()/get_response()
+        self.resp_queue = Queue()
+        # the job that is running, as [steps, future, is_batch, results]
+        self.job = None
         self.busy = False
-        self.screenshot_req = False
-        self.screenshot = None
         self.screen = screen
-        self.drive_thread = Thread(target=thread_fn, args=(self,) + tuple(args), daemon=True)
+        # set when there's something for update() to do (a command or a
+        # screenshot request) or the controller is done, so that the
+        # simulation can sleep while the robot is idle; several drivers can
+        # share one
+        self.wakeup = wakeup if wakeup is not None else Event()
+        self.frames = FrameStore(screen.get_width(), screen.get_height(), self.wakeup)
+        # forward moves that ended in a collision, by what was hit
+        self.collisions = {'rock': 0, 'robot': 0, 'barrier': 0, 'edge': 0}
+        # exception raised by the controller, if any
+        self.error = None
+        # gets every command that runs, if set; see internal.replay
+        self.log = None
+        # With several robots, picks are handed to picker(driver) instead of
+        # running straight away, and the result comes back through
+        # finish_pick() (see MainWindow.resolve_picks()).
+        self.picker = None
+        self.picking = False
+        # set by thread_fn once the controller is about to run
+        self.ready = Event()
+        # set once the controller has returned (or raised)
+        self.finished = False
+        self.drive_thread = Thread(target=self.thread_main, args=(thread_fn, args), daemon=True)
+
+    def thread_main(self, thread_fn, args):
+        try:
+            thread_fn(self, *args)
+        finally:
+            # start() waits for ready, which thread_fn may never have set if
+            # it failed early, and the simulation may be waiting for a
+            # command that won't come
+            self.ready.set()
+            self.finished = True
+            self.wakeup.set()
 
     def start(self):
+        """Start the controller, and wait until it is running (a controller
+        process can take a while to start up).
+        """
         self.drive_thread.start()
+        self.ready.wait()
+
+    def submit(self, cmd, params):
+        """Queue a command. Returns a Future that resolves to its response."""
+        future = Future()
+        self.cmd_queue.put(([(cmd, params)], future, False))
+        self.wakeup.set()
+        return future
+
+    def submit_batch(self, steps):
+        """Queue a list of (cmd, params) commands that run one after the other
+        without waiting for the controller in between. Returns a Future that
+        resolves to the list of responses. If a forward move collides, the
+        rest of the batch is skipped and gets {'s': False, 'e': 'aborted'}.
+        """
+        future = Future()
+        steps = list(steps)
+        if len(steps) == 0:
+            future.set_result([])
+        else:
+            self.cmd_queue.put((steps, future, True))
+            self.wakeup.set()
+        return future
 
     def send_command(self, cmd, params):
-        self.cmd_queue.put((cmd, params))
+        # older interface: the response goes to get_response(). The Future
+        # itself is queued, so that get_response() can raise its error (e.g.
+        # for an invalid command) in the controller's thread.
+        self.submit(cmd, params).add_done_callback(self.resp_queue.put)
 
     def get_response(self, wait=False):
         if not self.resp_queue.empty() or wait:
-            return self.resp_queue.get()
+            return self.resp_queue.get().result()
         return None
 
-    def request_screenshot(self):
-        self.screenshot = None
-        self.screenshot_req = True
-        while self.screenshot is None:
-            time.sleep(0.01)
-        return self.screenshot
+    @property
+    def screenshot_req(self):
+        return self.frames.wanted()
 
-    def update(self):
-        self.busy = self.robot.curr_move is not None
-        if not self.cmd_queue.empty():
-            cmd, payload = self.cmd_queue.get()
-            if cmd == 'fwd':
-                s = self.robot.forward(payload['dist'])
-                if not s:
-                    self.resp_queue.put(('fwd', {'s': False, 'e': 'Already moving'}))
-            elif cmd == 'turn':
-                s = self.robot.turn(payload['angle'])
-                if not s:
-                    self.resp_queue.put(('turn', {'s': False, 'e': 'Already moving'}))
-            elif cmd == 'pick':
-                n = self.robot.pick()
-                self.resp_queue.put(('pick', {'n': n}))
+    def request_screenshot(self, roi=None, scale=1, copy=False):
+        """Wait for the next captured frame; see FrameStore.get()."""
+        return self.frames.get(roi, scale, copy)
+
+    def current_command(self):
+        """A short description of the command that is running, like
+        'fwd 100', or '' if there isn't one.
+        """
+        if self.job is None:
+            return ''
+        steps, future, is_batch, results = self.job
+        cmd, params = steps[min(len(results), len(steps) - 1)]
+        values = ['%g' % v for v in params.values() if isinstance(v, (int, float))]
+        return ' '.join([cmd] + values)
+
+    def pending(self):
+        """True if there are commands running or waiting to run."""
+        return self.job is not None or not self.cmd_queue.empty()
+
+    def move_response(self, result):
+        """Response for a robot.MoveResult."""
+        if result.type == 'forward':
+            resp = {'s': result.success, 'd': result.moved}
+            if result.error is not None:
+                resp['e'] = result.error
+            if result.collider is not None:
+                resp['c'] = collider_type(result.collider)
+                self.collisions[resp['c']] += 1
+                self.stats.count('collision.' + resp['c'])
+            return ('fwd', resp)
+        elif result.type == 'turn':
+            return ('turn', {'s': result.success, 'd': result.moved})
+        raise ValueError("Unknown response type: %s" % result.type)
+
+    def finish_step(self, resp):
+        steps, future, is_batch, results = self.job
+        if self.log is not None:
+            self.log.finish(resp)
+        results.append(resp)
+        if is_batch and resp[0] == 'fwd' and not resp[1]['s']:
+            # collided; skip the rest of the batch
+            for cmd, params in steps[len(results):]:
+                results.append((cmd, {'s': False, 'e': 'aborted'}))
+        if len(results) == len(steps):
+            self.job = None
+            future.set_result(results if is_batch else results[0])
+
+    def finish_pick(self, n):
+        self.picking = False
+        self.stats.count('rocks picked', n)
+        self.finish_step(('pick', {'n': n}))
+
+    def start_step(self):
+        """Start the next step of the current job (fetching a new job if
+        needed). Returns False if there was nothing to start.
+        """
+        if self.job is None:
+            try:
+                steps, future, is_batch = self.cmd_queue.get_nowait()
+            except Empty:
+                return False
+            self.job = [steps, future, is_batch, []]
+
+        steps, future, is_batch, results = self.job
+        cmd, payload = steps[len(results)]
+        self.stats.count('cmd.' + cmd)
+        if self.log is not None:
+            self.log.start(cmd, payload)
+        if cmd == 'fwd':
+            self.robot.forward(payload['dist'])
+        elif cmd == 'turn':
+            self.robot.turn(payload['angle'])
+        elif cmd == 'pick':
+            if self.picker is not None:
+                self.picking = True
+                self.picker(self)
             else:
-                raise ValueError("Invalid command: %s" % cmd)
+                self.finish_pick(self.robot.pick())
+        elif cmd == 'scan':
+            dist, hits = self.robot.scan(payload['angles'], payload['max_dist'])
+            self.finish_step(('scan', {
+                'a': payload['angles'], 'd': dist,
+                'c': [None if h is None else collider_type(h) for h in hits]}))
+        else:
+            self.job = None
+            future.set_exception(ValueError("Invalid command: %s" % cmd))
+        return True
+
+    def update(self, screenshot=True):
+        """Process move results and start queued commands. If screenshot is
+        False, a pending screenshot request is left for a later update (used
+        when the screen hasn't been drawn this tick).
+        """
         if self.robot.curr_move_result is not None:
             result = self.robot.curr_move_result
             self.robot.curr_move_result = None
-            resp = None
-            if result['type'] == 'forward':
-                resp = {'s': result['success'], 'd': result['moved']}
-                if 'error' in result:
-                    resp['e'] = result['error']
-                if 'collider' in result:
-                    if 'rock' in result['collider'].info:
-                        resp['c'] = 'rock'
-                    elif isinstance(result['collider'], ScreenCollider):
-                        resp['c'] = 'edge'
-                    else:
-                        resp['c'] = 'barrier'
-                resp = ('fwd', resp) # bad code
-            elif result['type'] == 'turn':
-                resp = ('turn', {'s': result['success'], 'd': result['moved']})
-            else:
-                raise ValueError("Unknown response type: %s" % result['type'])
-            self.resp_queue.put(resp)
+            self.finish_step(self.move_response(result))
+
+        # picks finish straight away, so several commands can start in a tick
+        while self.robot.curr_move is None and not self.picking and self.start_step():
+            pass
+        self.busy = self.robot.curr_move is not None
 
-        if self.screenshot_req:
-            self.screenshot = pygame.surfarray.array3d(self.screen)
+        if screenshot and self.frames.wanted():
+            with self.stats.timer('screenshot'):
+                self.frames.capture(self.screen)
@@ -0,0 +1,74 @@
+# Double-buffered store for rendered frames, shared between the simulation
+# thread (which renders) and the controller (which wants screenshots).
+
+import threading
+
+import numpy as np
+import pygame
+
+class FrameStore:
+    """Holds the last captured frame as a preallocated row-major (H, W, 3)
+    RGB array.
+
+    Consumers call get(), which blocks until the next frame has been
+    captured. The simulation checks wanted() once per rendered frame and, if
+    anyone is waiting, calls capture(), which copies the screen into the back
+    buffer and swaps it to the front.
+
+    Frames are returned without copying, so they are only valid until the
+    next-but-one capture. Captures only happen while someone is waiting, so
+    a single consumer can use a frame until it asks for the next one.
+
+    If wakeup (a threading.Event) is given, it is set whenever someone starts
+    waiting, for a simulation loop that sleeps while nothing is happening.
+    """
+    def __init__(self, width, height, wakeup=None):
+        self.buffers = [np.zeros((height, width, 3), np.uint8) for i in range(2)]
+        self.front = 0
+        self.frame_no = 0
+        self.waiting = 0
+        self.cond = threading.Condition()
+        self.wakeup = wakeup
+
+    def wanted(self):
+        return self.waiting > 0
+
+    def capture(self, surface):
+        back = self.buffers[1 - self.front]
+        try:
+            # pixels3d is a (W, H, 3) view of the surface itself
+            view = pygame.surfarray.pixels3d(surface)
+        except ValueError:
+            # surfaces with odd pixel formats can't be viewed directly
+            view = pygame.surfarray.array3d(surface)
+        np.copyto(back, view.transpose(1, 0, 2))
+        del view # unlocks the surface
+
+        with self.cond:
+            self.front = 1 - self.front
+            self.frame_no += 1
+            self.cond.notify_all()
+
+    def get(self, roi=None, scale=1, copy=False):
+        """Wait for the next frame. roi is an optional (x, y, width, height)
+        region in pixels, and scale keeps every scale-th pixel in each
+        direction. Both are applied as views. Pass copy=True to get an array
+        that stays valid forever.
+        """
+        with self.cond:
+            target = self.frame_no + 1
+            self.waiting += 1
+            if self.wakeup is not None:
+                self.wakeup.set()
+            try:
+                self.cond.wait_for(lambda: self.frame_no >= target)
+            finally:
+                self.waiting -= 1
+            frame = self.buffers[self.front]
+
+        if roi is not None:
+            x, y, w, h = roi
+            frame = frame[y:y+h, x:x+w]
+        if scale > 1:
+            frame = frame[::scale, ::scale]
+        return frame.copy() if copy else frame
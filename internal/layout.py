@@ -0,0 +1,33 @@
+# Field layout shared by everything that simulates the field.
+# Coordinates have the origin at the center of the field, with y pointing up.
+
+# simulation ticks per second of simulated time (and frames per second when
+# running in real time)
+TICK_RATE = 60
+
+FIELD_WIDTH  = 720
+FIELD_HEIGHT = 720
+
+# barriers as (left, top, right, bottom)
+BARRIERS = (
+    (-360, 250,  168, 200),
+    (-171, 40,   360, -15),
+    (-360, -183, 169, -235),
+)
+
+ROBOT_RADIUS  = 20 # half the width of the robot's bounding box
+ROBOT_SPEED   = 2  # units per tick
+ROBOT_START   = (0, 100)
+# where robots start when there are several, in order (the first is
+# ROBOT_START); rows in the gaps between the barriers
+ROBOT_STARTS  = tuple((x, y) for y in (100, -100, 300, -300)
+                      for x in (0, 100, -100, 200, -200, 300, -300))
+# the robot picks up rocks within PICK_SCALE * ROBOT_RADIUS of its center,
+# measured to ROCK_PICK_SCALE * the rock's radius
+PICK_SCALE      = 1.7
+ROCK_PICK_SCALE = 1.2
+
+ROCK_COUNT = 24
+ROCK_RADII = (12, 16, 20)
+# how many different-looking rocks there are of each radius
+ROCK_SPRITE_VARIANTS = 8
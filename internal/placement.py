@@ -0,0 +1,162 @@
+# Ways of scattering rocks over the field.
+#
+# Both functions take a random.Random, the radius of each rock, and a
+# collider holding everything the rocks must not touch (the screen edges,
+# barriers and the robot), and return a list of integer (x, y) centers.
+# They raise ValueError if they can't find room for a rock.
+
+from math import ceil
+
+from internal.collision import AABB, GridCollisionSet
+
+def place_uniform(rng, radii, obstacles, width, height, max_attempts=10000):
+    """Uniformly random positions, rejecting any that hit something placed
+    before (the original placement method). Gives up after max_attempts
+    tries for a single rock.
+    """
+    placed = GridCollisionSet()
+    positions = []
+    for i, rad in enumerate(radii):
+        box = AABB(2*rad, 2*rad)
+        for attempt in range(max_attempts):
+            box.x = int(rng.random() * width - width/2)
+            box.y = int(rng.random() * height - height/2)
+            if obstacles.test(box) is None and placed.test(box) is None:
+                break
+        else:
+            raise ValueError("Can't place rock %d of %d (radius %d) after %d attempts" %
+                             (i + 1, len(radii), rad, max_attempts))
+        placed.add_collider(box)
+        positions.append((box.x, box.y))
+    return positions
+
+def poisson_disk(rng, width, height, spacing, k=30):
+    """Bridson's algorithm: blue-noise points covering [0, width) x [0,
+    height), no two of which are closer than spacing along both axes (so
+    squares of that size around them never overlap).
+    """
+    cols, rows = ceil(width / spacing), ceil(height / spacing)
+    # each cell is small enough to hold at most one point
+    grid = [None] * (cols * rows)
+
+    def fits(x, y):
+        gx, gy = int(x / spacing), int(y / spacing)
+        for i in range(max(gx - 1, 0), min(gx + 2, cols)):
+            for j in range(max(gy - 1, 0), min(gy + 2, rows)):
+                p = grid[j * cols + i]
+                if p is not None and abs(p[0] - x) < spacing and abs(p[1] - y) < spacing:
+                    return False
+        return True
+
+    def add(x, y):
+        grid[int(y / spacing) * cols + int(x / spacing)] = (x, y)
+        points.append((x, y))
+        active.append((x, y))
+
+    points = []
+    active = []
+    add(rng.random() * width, rng.random() * height)
+    while active:
+        i = int(rng.random() * len(active))
+        px, py = active[i]
+        for attempt in range(k):
+            # somewhere in the square ring between spacing and 2*spacing away
+            while True:
+                dx = (rng.random() * 4 - 2) * spacing
+                dy = (rng.random() * 4 - 2) * spacing
+                if max(abs(dx), abs(dy)) >= spacing:
+                    break
+            x, y = px + dx, py + dy
+            if 0 <= x < width and 0 <= y < height and fits(x, y):
+                add(x, y)
+                break
+        else:
+            # nothing more fits around this point
+            active[i] = active[-1]
+            active.pop()
+    return points
+
+def thin(points, spacing):
+    """The points (in order) that are at least spacing away from every
+    earlier point that was kept, along one axis or the other. Thinning a
+    Poisson-disk set like this gives a sparser one that still covers the
+    whole area.
+    """
+    grid = {}
+    kept = []
+    for x, y in points:
+        gx, gy = x // spacing, y // spacing
+        if all(p is None or abs(p[0] - x) >= spacing or abs(p[1] - y) >= spacing
+               for p in (grid.get((gx + i, gy + j)) for i in (-1, 0, 1) for j in (-1, 0, 1))):
+            grid[gx, gy] = (x, y)
+            kept.append((x, y))
+    return kept
+
+def place_poisson(rng, radii, obstacles, width, height, darts=30, dense=0.25,
+                  max_attempts=10000):
+    """Placement that stays fast on sparse fields and still fits crowded
+    ones. Rocks are placed largest first. If they cover less than `dense`
+    of the field, each takes the first of `darts` random positions where it
+    doesn't hit an obstacle or a rock placed before it, which is all a
+    normal field needs.
+
+    On a crowded field (or once darts start missing), random positions
+    waste too much space, so a Poisson-disk set of candidate points is
+    generated over the whole field, spaced so that two of the smallest rocks
+    can't touch, and thinned out for each bigger size. Rocks then take the
+    next candidate for their size (in random order) that is free.
+    Candidates next to a bigger rock are often blocked even though a spot a
+    few pixels away is free, so once a size runs out of candidates, its
+    rocks go back to random positions, giving up after max_attempts tries
+    for a single rock like place_uniform() does.
+    """
+    if len(radii) == 0:
+        return []
+    if sum((2*rad) ** 2 for rad in radii) >= dense * width * height:
+        darts = 0
+    placed = GridCollisionSet()
+    positions = [None] * len(radii)
+    # the Poisson-disk points and, for each size, the candidates left;
+    # only made once they are needed
+    points = None
+    candidates = {}
+
+    def fits(box):
+        return obstacles.test(box) is None and placed.test(box) is None
+
+    def dart(box, attempts):
+        for attempt in range(attempts):
+            box.x = int(rng.random() * width - width/2)
+            box.y = int(rng.random() * height - height/2)
+            if fits(box):
+                return True
+        return False
+
+    order = sorted(range(len(radii)), key=lambda i: -radii[i])
+    for n, i in enumerate(order):
+        rad = radii[i]
+        box = AABB(2*rad, 2*rad)
+        if not dart(box, darts):
+            if points is None:
+                # +1 so that rounding to whole pixels can't make rocks overlap
+                points = poisson_disk(rng, width, height, 2 * min(radii) + 1)
+                rng.shuffle(points)
+                points = [(int(round(x - width/2)), int(round(y - height/2)))
+                          for x, y in points]
+            if rad not in candidates:
+                # consumed from the end; a candidate that is blocked now
+                # stays blocked, since rocks are only ever added
+                candidates[rad] = thin(points, 2*rad + 1)[::-1]
+            left = candidates[rad]
+            while left:
+                box.x, box.y = left.pop()
+                if fits(box):
+                    break
+            else:
+                if not dart(box, max_attempts):
+                    raise ValueError("Can't place rock %d of %d (radius %d): no free spot "
+                                     "found after %d random attempts" %
+                                     (n + 1, len(radii), rad, max_attempts))
+        placed.add_collider(box)
+        positions[i] = (box.x, box.y)
+    return positions
@@ -0,0 +1,178 @@
+# Running the controller in its own process, so that heavy Python code in the
+# controller doesn't compete with the simulation for the GIL.
+#
+# The simulator side (process_thread_fn) runs on the Driver's thread in place
+# of the usual controller thread. It starts the controller process and relays
+# its commands to the Driver. The controller side (ProcessDriver) looks like a
+# Driver to external.robot.Robot. Commands and responses go over a pipe;
+# screenshots are copied into a shared memory buffer instead of being pickled.
+
+import atexit
+import multiprocessing
+import threading
+import traceback
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from queue import Queue
+
+import numpy as np
+
+from external import robot as robot_ex
+
+def process_thread_fn(driver, robot_fn):
+    """Run robot_fn in a child process, relaying its requests to driver.
+    robot_fn has to be picklable (a module-level function).
+    """
+    height, width, depth = driver.frames.buffers[0].shape
+    shm = shared_memory.SharedMemory(create=True, size=height * width * depth)
+    frame = np.ndarray((height, width, depth), np.uint8, buffer=shm.buf)
+    # set once they exist; starting the process fails if robot_fn can't be
+    # pickled
+    conn = None
+    proc = None
+
+    def cleanup():
+        if proc is not None:
+            proc.join(1)
+            if proc.is_alive():
+                proc.terminate()
+        if conn is not None:
+            conn.close()
+        shm.unlink()
+        try:
+            shm.close()
+        except BufferError:
+            # frame is still around if the simulator is exiting
+            pass
+    # this thread is a daemon, so if the simulator exits first (e.g. after
+    # max_ticks), the finally block below never runs
+    atexit.register(cleanup)
+
+    send_lock = threading.Lock()
+    def send(msg):
+        with send_lock:
+            conn.send(msg)
+
+    def reply(req_id, future):
+        try:
+            send(('resp', req_id, future.result()))
+        except Exception as e:
+            send(('err', req_id, e))
+
+    try:
+        ctx = multiprocessing.get_context('spawn')
+        conn, child_conn = ctx.Pipe()
+        child = ctx.Process(target=child_main, daemon=True,
+                            args=(robot_fn, child_conn, shm.name, frame.shape))
+        try:
+            child.start()
+        finally:
+            child_conn.close()
+        proc = child
+
+        while True:
+            try:
+                msg = conn.recv()
+            except EOFError:
+                break
+            kind, req_id = msg[0], msg[1]
+            if kind == 'ready':
+                driver.ready.set()
+            elif kind == 'cmd':
+                driver.submit(msg[2], msg[3]).add_done_callback(
+                        lambda f, req_id=req_id: reply(req_id, f))
+            elif kind == 'batch':
+                driver.submit_batch(msg[2]).add_done_callback(
+                        lambda f, req_id=req_id: reply(req_id, f))
+            elif kind == 'shot':
+                img = driver.request_screenshot(msg[2], msg[3])
+                h, w = img.shape[:2]
+                np.copyto(frame[:h, :w], img)
+                send(('shot', req_id, (h, w)))
+            elif kind == 'done':
+                driver.error = msg[2]
+                break
+    except Exception as e:
+        driver.error = e
+        raise
+    finally:
+        # in case the child died before it got going
+        driver.ready.set()
+        del frame
+        atexit.unregister(cleanup)
+        cleanup()
+
+def child_main(robot_fn, conn, shm_name, shape):
+    driver = ProcessDriver(conn, shm_name, shape)
+    driver.send(('ready', None))
+    error = None
+    try:
+        robot_fn(robot_ex.Robot(driver))
+    except Exception as e:
+        traceback.print_exc()
+        error = e
+    try:
+        driver.send(('done', None, error))
+    except Exception:
+        # the exception couldn't be pickled
+        driver.send(('done', None, RuntimeError(repr(error))))
+
+class ProcessDriver:
+    """Stands in for internal.driver.Driver in the controller's process."""
+    def __init__(self, conn, shm_name, shape):
+        self.conn = conn
+        self.shm = shared_memory.SharedMemory(name=shm_name)
+        self.frame = np.ndarray(shape, np.uint8, buffer=self.shm.buf)
+        self.resp_queue = Queue()
+        self.futures = {}
+        self.next_id = 0
+        self.lock = threading.Lock()
+        self.reader = threading.Thread(target=self.read, daemon=True)
+        self.reader.start()
+
+    def read(self):
+        while True:
+            try:
+                kind, req_id, payload = self.conn.recv()
+            except (EOFError, OSError):
+                return
+            with self.lock:
+                future = self.futures.pop(req_id)
+            if kind == 'err':
+                future.set_exception(payload)
+            else:
+                future.set_result(payload)
+
+    def send(self, msg):
+        with self.lock:
+            self.conn.send(msg)
+
+    def request(self, kind, *args):
+        future = Future()
+        with self.lock:
+            req_id = self.next_id
+            self.next_id += 1
+            self.futures[req_id] = future
+            self.conn.send((kind, req_id) + args)
+        return future
+
+    def submit(self, cmd, params):
+        return self.request('cmd', cmd, params)
+
+    def submit_batch(self, steps):
+        return self.request('batch', list(steps))
+
+    def send_command(self, cmd, params):
+        # the Future itself is queued, so that get_response() can raise its
+        # error (e.g. for an invalid command) in the controller's thread
+        self.submit(cmd, params).add_done_callback(self.resp_queue.put)
+
+    def get_response(self, wait=False):
+        if not self.resp_queue.empty() or wait:
+            return self.resp_queue.get().result()
+        return None
+
+    def request_screenshot(self, roi=None, scale=1, copy=False):
+        h, w = self.request('shot', roi, scale).result()
+        img = self.frame[:h, :w]
+        return img.copy() if copy else img
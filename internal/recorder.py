@@ -0,0 +1,174 @@
+# Recording runs to a file without slowing the simulation down.
+#
+# The simulation thread only copies each frame's raw 32-bit pixels into a
+# preallocated ring buffer, which is a plain memory copy; a worker thread
+# unpacks them to RGB and encodes them. If the worker falls behind and the
+# buffer fills up, new frames are dropped rather than making the simulation
+# wait.
+#
+# Files ending in .avi, .mp4 or .mkv are written with OpenCV's VideoWriter,
+# with the tick and the current command drawn in the corner. Anything else
+# gets the simple delta format below, which needs nothing but zlib and keeps
+# the exact pixels; the tick and command are stored as text with each frame.
+#
+# Delta format (little-endian): a header with magic, format version, width,
+# height and frame rate, then for each frame its tick, the length of its
+# label, the length of its data, the label (UTF-8), and the data: the frame
+# XORed with the previous one (all zeros before the first), zlib-compressed.
+
+import os
+import struct
+import threading
+import zlib
+
+import numpy as np
+import pygame
+
+MAGIC = b'RBRC'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHHHd')
+FRAME  = struct.Struct('<IHI')
+
+VIDEO_CODECS = {'.avi': 'MJPG', '.mp4': 'mp4v', '.mkv': 'MJPG'}
+
+class VideoEncoder:
+    def __init__(self, path, width, height, fps):
+        import cv2
+        self.cv2 = cv2
+        codec = VIDEO_CODECS[os.path.splitext(path)[1].lower()]
+        self.writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps, (width, height))
+        if not self.writer.isOpened():
+            raise ValueError("Can't write video to %s" % path)
+
+    def write(self, frame, tick, label):
+        cv2 = self.cv2
+        img = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+        text = "tick %d  %s" % (tick, label)
+        cv2.putText(img, text, (5, 15), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 0), 3)
+        cv2.putText(img, text, (5, 15), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
+        self.writer.write(img)
+
+    def close(self):
+        self.writer.release()
+
+class DeltaEncoder:
+    def __init__(self, path, width, height, fps):
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, FORMAT_VERSION, width, height, fps))
+        self.prev = np.zeros((height, width, 3), np.uint8)
+        self.delta = np.zeros_like(self.prev)
+
+    def write(self, frame, tick, label):
+        np.bitwise_xor(frame, self.prev, out=self.delta)
+        np.copyto(self.prev, frame)
+        data = zlib.compress(self.delta.data, 1)
+        label = label.encode('utf-8')
+        self.file.write(FRAME.pack(tick, len(label), len(data)))
+        self.file.write(label)
+        self.file.write(data)
+
+    def close(self):
+        self.file.close()
+
+def read_recording(path):
+    """Read a file in the delta format. Yields (tick, label, frame) for each
+    frame, where frame is an (H, W, 3) RGB array.
+    """
+    with open(path, 'rb') as f:
+        magic, fmt, width, height, fps = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("%s is not a recording" % path)
+        if fmt != FORMAT_VERSION:
+            raise ValueError("Unsupported recording format version %d" % fmt)
+        frame = np.zeros((height, width, 3), np.uint8)
+        while True:
+            data = f.read(FRAME.size)
+            if len(data) < FRAME.size:
+                return
+            tick, label_len, data_len = FRAME.unpack(data)
+            label = f.read(label_len).decode('utf-8')
+            delta = np.frombuffer(zlib.decompress(f.read(data_len)), np.uint8)
+            frame ^= delta.reshape(frame.shape)
+            yield tick, label, frame.copy()
+
+class Recorder:
+    """Records frames to path in the background. Frames are downsampled by
+    keeping every scale-th pixel, and up to buffer_frames of them can wait to
+    be encoded.
+    """
+    def __init__(self, path, width, height, fps=60, scale=1, buffer_frames=64):
+        self.path = path
+        self.scale = scale
+        w, h = len(range(0, width, scale)), len(range(0, height, scale))
+        if os.path.splitext(path)[1].lower() in VIDEO_CODECS:
+            self.encoder = VideoEncoder(path, w, h, fps)
+        else:
+            self.encoder = DeltaEncoder(path, w, h, fps)
+
+        # raw pixels, and (tick, label, channel shifts) for each slot
+        self.frames = np.zeros((buffer_frames, h, w), np.uint32)
+        self.labels = [None] * buffer_frames
+        # frames waiting to be encoded are slots head .. head+count-1
+        self.head = 0
+        self.count = 0
+        self.recorded = 0
+        self.dropped = 0
+        self.closed = False
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def add(self, surface, tick, label=''):
+        """Queue a copy of surface. Never waits for the encoder: returns False
+        (and drops the frame) if the buffer is full.
+        """
+        n = len(self.frames)
+        with self.cond:
+            if self.count == n:
+                self.dropped += 1
+                return False
+            slot = (self.head + self.count) % n
+        # the worker doesn't look at this slot until count goes up
+        if surface.get_bytesize() != 4:
+            converted = pygame.Surface(surface.get_size(), 0, 32)
+            converted.blit(surface, (0, 0))
+            surface = converted
+        # pixels2d is a (W, H) view of the surface, so its transpose is laid
+        # out just like the slot
+        view = pygame.surfarray.pixels2d(surface)
+        s = self.scale
+        np.copyto(self.frames[slot], view.T[::s, ::s])
+        del view # unlocks the surface
+        self.labels[slot] = (tick, label, surface.get_shifts()[:3])
+        with self.cond:
+            self.count += 1
+            self.cond.notify()
+        return True
+
+    def work(self):
+        n = len(self.frames)
+        rgb = np.zeros(self.frames.shape[1:] + (3,), np.uint8)
+        channel = np.zeros(self.frames.shape[1:], np.uint32)
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.count > 0 or self.closed)
+                if self.count == 0:
+                    return
+                slot = self.head
+            tick, label, shifts = self.labels[slot]
+            for i, shift in enumerate(shifts):
+                np.right_shift(self.frames[slot], shift, out=channel)
+                rgb[..., i] = channel # keeps the low byte
+            self.encoder.write(rgb, tick, label)
+            with self.cond:
+                self.head = (self.head + 1) % n
+                self.count -= 1
+                self.recorded += 1
+
+    def close(self):
+        """Encode whatever is still buffered and close the file."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+        self.encoder.close()
@@ -0,0 +1,251 @@
+# Recording the commands a controller runs, and replaying them.
+#
+# A log starts with a header describing the field (seed, rock count and
+# placement), followed by one record for every command the robot ran: the
+# tick it started on, the command, its parameters and its result. Replaying a
+# log runs the same commands on the same field at the same ticks, without the
+# controller, and checks that every result comes out the same.
+#
+# Everything is little-endian. Header: magic, format version, seed, rock
+# count, placement. Each record starts with its tick and command code, and the
+# rest depends on the command:
+#   fwd:  distance; success, distance moved, what it hit (COLLIDERS)
+#   turn: angle; success, angle turned
+#   pick: number of rocks picked up
+#   scan: max distance, number of rays, the ray angles; then the distance and
+#         what was hit (COLLIDERS) for each ray
+
+import struct
+import time
+from collections import namedtuple
+
+import numpy as np
+
+MAGIC = b'RBLG'
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct('<4sHqIB')
+RECORD = struct.Struct('<IB')
+FWD    = struct.Struct('<d?dB')
+TURN   = struct.Struct('<d?d')
+PICK   = struct.Struct('<H')
+SCAN   = struct.Struct('<dH')
+
+COMMANDS   = (None, 'fwd', 'turn', 'pick', 'scan')
+COLLIDERS  = (None, 'rock', 'barrier', 'edge', 'robot')
+PLACEMENTS = ('poisson', 'uniform')
+
+Header = namedtuple('Header', 'seed rock_count rock_placement')
+# params and result are tuples of plain values, in the order they are stored
+Record = namedtuple('Record', 'tick cmd params result')
+
+def make_record(tick, cmd, params, resp):
+    """Build a Record from a driver command and its response."""
+    if cmd == 'fwd':
+        return Record(tick, cmd, (params['dist'],),
+                      (resp['s'], resp['d'], resp.get('c')))
+    elif cmd == 'turn':
+        return Record(tick, cmd, (params['angle'],), (resp['s'], resp['d']))
+    elif cmd == 'pick':
+        return Record(tick, cmd, (), (resp['n'],))
+    elif cmd == 'scan':
+        return Record(tick, cmd, (params['max_dist'], tuple(np.asarray(params['angles'], float))),
+                      (tuple(np.asarray(resp['d'], float)), tuple(resp['c'])))
+    raise ValueError("Can't log command: %s" % cmd)
+
+def command_params(record):
+    """The driver parameters for a Record's command."""
+    if record.cmd == 'fwd':
+        return {'dist': record.params[0]}
+    elif record.cmd == 'turn':
+        return {'angle': record.params[0]}
+    elif record.cmd == 'pick':
+        return {}
+    return {'max_dist': record.params[0], 'angles': np.array(record.params[1])}
+
+def encode(record):
+    data = RECORD.pack(record.tick, COMMANDS.index(record.cmd))
+    p, r = record.params, record.result
+    if record.cmd == 'fwd':
+        data += FWD.pack(p[0], r[0], r[1], COLLIDERS.index(r[2]))
+    elif record.cmd == 'turn':
+        data += TURN.pack(p[0], r[0], r[1])
+    elif record.cmd == 'pick':
+        data += PICK.pack(r[0])
+    else:
+        n = len(p[1])
+        data += SCAN.pack(p[0], n)
+        data += struct.pack('<%dd%dd%dB' % (n, n, n), *p[1], *r[0],
+                            *(COLLIDERS.index(c) for c in r[1]))
+    return data
+
+def read_exact(f, n):
+    data = f.read(n)
+    if len(data) != n:
+        raise ValueError("Truncated log")
+    return data
+
+def decode(f):
+    """Read the next Record from f, or None at the end of the file."""
+    data = f.read(RECORD.size)
+    if len(data) == 0:
+        return None
+    if len(data) != RECORD.size:
+        raise ValueError("Truncated log")
+    tick, code = RECORD.unpack(data)
+    cmd = COMMANDS[code]
+    if cmd == 'fwd':
+        dist, s, d, c = FWD.unpack(read_exact(f, FWD.size))
+        return Record(tick, cmd, (dist,), (s, d, COLLIDERS[c]))
+    elif cmd == 'turn':
+        angle, s, d = TURN.unpack(read_exact(f, TURN.size))
+        return Record(tick, cmd, (angle,), (s, d))
+    elif cmd == 'pick':
+        return Record(tick, cmd, (), PICK.unpack(read_exact(f, PICK.size)))
+    elif cmd == 'scan':
+        max_dist, n = SCAN.unpack(read_exact(f, SCAN.size))
+        fmt = '<%dd%dd%dB' % (n, n, n)
+        values = struct.unpack(fmt, read_exact(f, struct.calcsize(fmt)))
+        return Record(tick, cmd, (max_dist, values[:n]),
+                      (values[n:2*n], tuple(COLLIDERS[c] for c in values[2*n:])))
+    raise ValueError("Unknown command code %d in log" % code)
+
+def read_log(path):
+    """Read a log file. Returns its Header and a list of Records."""
+    with open(path, 'rb') as f:
+        magic, fmt, seed, rock_count, placement = HEADER.unpack(read_exact(f, HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("%s is not a command log" % path)
+        if fmt != FORMAT_VERSION:
+            raise ValueError("Unsupported log format version %d" % fmt)
+        records = []
+        while True:
+            record = decode(f)
+            if record is None:
+                break
+            records.append(record)
+    return Header(seed, rock_count, PLACEMENTS[placement]), records
+
+class CommandLog:
+    """Records the commands run by a Driver (set it as driver.log). clock()
+    returns the current tick.
+    """
+    def __init__(self, clock):
+        self.clock = clock
+        self.current = None
+
+    def start(self, cmd, params):
+        self.current = (self.clock(), cmd, params)
+
+    def finish(self, resp):
+        tick, cmd, params = self.current
+        self.current = None
+        self.write(make_record(tick, cmd, params, resp[1]))
+
+    def write(self, record):
+        pass
+
+    def close(self):
+        pass
+
+class LogWriter(CommandLog):
+    """Writes a log file for a field with the given seed, rock count and
+    placement.
+    """
+    def __init__(self, path, clock, seed, rock_count, rock_placement):
+        super().__init__(clock)
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, FORMAT_VERSION, seed, rock_count,
+                                    PLACEMENTS.index(rock_placement)))
+
+    def write(self, record):
+        self.file.write(encode(record))
+
+    def close(self):
+        self.file.close()
+
+class LogChecker(CommandLog):
+    """Compares the commands run by a Driver with the Records in a log, and
+    remembers the first one that differs.
+    """
+    def __init__(self, clock, expected):
+        super().__init__(clock)
+        self.expected = expected
+        self.count = 0
+        # (index, expected Record, Record that was actually run)
+        self.divergence = None
+
+    def write(self, record):
+        i = self.count
+        self.count += 1
+        if self.divergence is None and (i >= len(self.expected) or record != self.expected[i]):
+            self.divergence = (i, self.expected[i] if i < len(self.expected) else None, record)
+
+def replay(path):
+    """Run the commands from a log on the same field, headless and as fast as
+    possible, starting each one on the tick that it started on originally.
+
+    Returns a dict with 'ok' (True if everything matched), 'commands' (how
+    many were replayed), 'ticks', 'wall_time' and 'rocks_left'. If something
+    didn't match, 'tick' is the first tick on which the replay differed, and
+    'expected' and 'got' are the Records from the log and from the replay.
+    """
+    from internal import layout, window
+
+    header, records = read_log(path)
+    start_time = time.perf_counter()
+    # no controller: the driver's thread is never started, and the commands
+    # are queued from here instead
+    win = window.MainWindow(None, True, seed=header.seed, rock_count=header.rock_count,
+                            rock_placement=header.rock_placement)
+    check = LogChecker(lambda: win.ticks, records)
+    win.driver.log = check
+    driver, robot = win.driver, win.robot
+
+    # in case a move never finishes (which would have been a divergence
+    # anyway, since the log has a result for it)
+    last_tick = (records[-1].tick if records else 0) + 3600 * layout.TICK_RATE
+
+    i = 0
+    while check.divergence is None and win.ticks <= last_tick:
+        while i < len(records) and records[i].tick <= win.ticks:
+            driver.submit(records[i].cmd, command_params(records[i]))
+            i += 1
+        idle = robot.curr_move is None and not driver.pending()
+        if idle and i == len(records):
+            break
+        if idle:
+            # nothing happens until the next command; skip ahead to it
+            win.ticks = records[i].tick
+            continue
+        win.update()
+    if check.divergence is None and check.count < len(records):
+        check.divergence = (check.count, records[check.count], None)
+
+    result = {'ok': check.divergence is None, 'commands': check.count,
+              'ticks': win.ticks, 'wall_time': time.perf_counter() - start_time,
+              'rocks_left': len(win.rocks)}
+    if check.divergence is not None:
+        index, expected, got = check.divergence
+        result['commands'] = index
+        result['tick'] = min(r.tick for r in (expected, got) if r is not None)
+        result['expected'] = expected
+        result['got'] = got
+    return result
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Replay a command log and check that it still gives the same results")
+    parser.add_argument('log', help="log file written with main.py --log")
+    args = parser.parse_args(argv)
+
+    result = replay(args.log)
+    print("Replayed %d commands in %.3fs (%d ticks, %d rocks left)" %
+          (result['commands'], result['wall_time'], result['ticks'], result['rocks_left']))
+    if result['ok']:
+        print("OK: every result matched")
+        return 0
+    print("DIVERGED at tick %d (command %d)" % (result['tick'], result['commands']))
+    print("  expected: %s" % (result['expected'],))
+    print("  got:      %s" % (result['got'],))
+    return 1
@@ -1,10 +1,61 @@
 from math import *
 from internal.collision import *
+from internal.world import KIND_ROCK
+from internal import layout
 
+import numpy as np
 import pygame
 
+def steps_to_target(start, target, speed):
+    """Number of ticks t until start + speed * t reaches target, using the same
+    comparisons as a move does each tick. Returns None if it never does.
+    """
+    dir = 1 if target >= start else -1
+    if start == target:
+        return 0
+    if speed * dir <= 0:
+        return None
+    t = max(0, ceil((target - start) / speed))
+    reached = lambda t: (start + speed * t >= target) if dir == 1 \
+                   else (start + speed * t <= target)
+    while t > 0 and reached(t - 1):
+        t -= 1
+    while not reached(t):
+        t += 1
+    return t
+
+class Move:
+    """The move a robot is making. stop is the tick (relative to t0) at which
+    it ends, or None if it never does; for forward moves, end is the distance
+    it ends at and result is how it ends.
+    """
+    __slots__ = ('t0', 'type', 'start', 'target', 'speed', 'stop', 'end', 'result')
+
+    def __init__(self, t0, type, start, target, speed):
+        self.t0 = t0
+        self.type = type
+        self.start = start
+        self.target = target
+        self.speed = speed
+        self.stop = None
+        self.end = None
+        self.result = None
+
+class MoveResult:
+    """How a move ended. error and collider are only set for a forward move
+    that ran into something.
+    """
+    __slots__ = ('type', 'success', 'moved', 'error', 'collider')
+
+    def __init__(self, type, success, moved, error=None, collider=None):
+        self.type = type
+        self.success = success
+        self.moved = moved
+        self.error = error
+        self.collider = collider
+
 class InternalRobot:
-    def __init__(self, bbox_radius, speed, window):
+    def __init__(self, bbox_radius, speed, window, index=0):
         # position where the robot turned last (or was placed initially)
         self.last_turn_x = 0
         self.last_turn_y = 0
@@ -16,17 +67,26 @@ class InternalRobot:
         self.speed = speed
 
         self.bbox_radius = bbox_radius
-        self.pick_radius = bbox_radius * 1.7
+        self.pick_radius = bbox_radius * layout.PICK_SCALE
         self.window = window
         self.collider = window.collision
+        self.stats = window.stats
         self.bbox = AABB(2*self.bbox_radius, 2*self.bbox_radius, 0, 0)
 
+        # With several robots on the field, every robot's box is kept in one
+        # shared index (set up by the window), and forward moves check it
+        # every tick on top of the planned result. Boxes can't move while
+        # they are in the index, so each robot has a separate one for it.
+        self.index = index
+        self.robot_index = None
+        self.index_box = AABB(2*self.bbox_radius, 2*self.bbox_radius, 0, 0)
+        self.index_box.info = {'robot': self}
+
         self.curr_move = None
         self.curr_move_result = None
         self.tick = 0
 
         self.image = pygame.image.load("internal/field/robot.png")
-        self.image_rotated = self.image # until it rotates
 
     def get_position(self):
         return (self.last_turn_x + self.dist * cos(self.heading),
@@ -36,55 +96,167 @@ class InternalRobot:
         if self.curr_move is not None:
             return False
 
-        self.curr_move = {
-            't0'    : self.tick,
-            'type'  : 'forward',
-            'start' : self.dist,
-            'target': self.dist + distance,
-            'speed' : self.speed # in case we want this variable or something
-        }
+        self.curr_move = Move(self.tick, 'forward', self.dist, self.dist + distance, self.speed)
+        self.plan_forward()
         return True
 
+    def dist_at(self, t):
+        """Distance along the current forward move after t ticks."""
+        return self.curr_move.start + self.curr_move.speed * t
+
+    def collides_at(self, t):
+        self.dist = self.dist_at(t)
+        return self.collides()
+
+    def plan_forward(self):
+        """Work out when and how the current forward move ends.
+
+        The path is swept against the collision set once to find the time of
+        impact, and then the ticks around it are checked with the normal
+        collision test so the result is exactly what stepping the move one
+        tick at a time would give. This assumes nothing else moves while the
+        robot does.
+
+        Fills in stop, end and result on curr_move.
+        """
+        move = self.curr_move
+        d0 = move.start
+        spd = move.speed
+        done = steps_to_target(d0, move.target, spd)
+
+        # sweep from the start position
+        self.update_bb()
+        dx, dy = cos(self.heading), sin(self.heading)
+        if spd < 0:
+            dx, dy = -dx, -dy
+        length = inf if done is None else abs(spd) * done
+        with self.stats.timer('sweep'):
+            s = self.collider.sweep(self.bbox, dx, dy, length)
+
+        hit = None
+        if s is not None:
+            # first tick that is strictly past the point of impact
+            t = min(floor(s / abs(spd)) + 1, done if done is not None else inf)
+            while t > 0 and self.collides_at(t - 1) is not None:
+                t -= 1
+            while done is None or t <= done:
+                hit = self.collides_at(t)
+                if hit is not None:
+                    break
+                t += 1
+        self.dist = d0
+
+        if hit is not None:
+            move.stop = t
+            move.end = self.dist_at(t - 1) if t > 0 else d0
+            move.result = MoveResult('forward', False, move.end - d0, 'collision', hit)
+        else:
+            move.stop = done
+            move.end = move.target
+            move.result = MoveResult('forward', True, move.target - d0)
+
     def turn(self, angle):
         if self.curr_move is not None:
             return False
 
-        self.curr_move = {
-            't0'    : self.tick,
-            'type'  : 'turn',
-            'start' : self.heading,
-            'target': self.heading + angle,
-            # ensure that the outer edge of the robot moves at the same speed as
-            # when the robot moves forward
-            'speed' : self.speed / (pi * self.bbox_radius)
-        }
+        # ensure that the outer edge of the robot moves at the same speed as
+        # when the robot moves forward
+        self.curr_move = Move(self.tick, 'turn', self.heading, self.heading + angle,
+                              self.speed / (pi * self.bbox_radius))
+        self.curr_move.stop = steps_to_target(
+                self.heading, self.curr_move.target, self.curr_move.speed)
         self.last_turn_x, self.last_turn_y = self.get_position()
         self.dist = 0
         return True
 
+    def rock_distance(self, rock):
+        x, y = self.get_position()
+        return sqrt((x - rock.collider.x) ** 2 + (y - rock.collider.y) ** 2)
+
+    def rocks_in_range(self):
+        world = self.window.world
+        x, y = self.get_position()
+        slots = world.live(KIND_ROCK)
+        center = world.center[slots]
+        dist = np.sqrt((x - center[:, 0]) ** 2 + (y - center[:, 1]) ** 2)
+        in_range = dist < self.pick_radius + world.half[slots, 0] * layout.ROCK_PICK_SCALE
+        return [world.owners[i] for i in slots[in_range]]
+
     def pick(self):
         if self.curr_move is not None:
             return 0
 
-        x, y = self.get_position()
-        to_remove = []
-        for rock in self.window.rocks:
-            rock_rad = (rock.collider.width / 2) * 1.2
-            dist = sqrt((x - rock.collider.x) ** 2 + (y - rock.collider.y) ** 2)
-            if dist < self.pick_radius + rock_rad:
-                to_remove.append(rock)
-
+        to_remove = self.rocks_in_range()
         for rock in to_remove:
-            self.window.collision.remove_collider(rock.collider)
-            self.window.rocks.remove(rock)
+            self.window.remove_rock(rock)
         return len(to_remove)
 
+    def scan(self, angles, max_dist=inf):
+        """Cast rays from the robot's center at the given angles (relative to
+        its heading). Returns the distance along each ray to the first thing
+        it hits, and what it hit; rays that hit nothing within max_dist get
+        inf and None. Other robots on the field are seen too.
+        """
+        x, y = self.get_position()
+        a = self.heading + np.asarray(angles, dtype=float)
+        with self.stats.timer('scan'):
+            dist, hits = self.collider.raycast(x, y, np.cos(a), np.sin(a))
+            if self.robot_index is not None:
+                # the other robots' boxes; the rays start inside this one's
+                others = [box for box in self.robot_index.colliders if box is not self.index_box]
+                bounds = np.array([(box.l(), box.b(), box.r(), box.t()) for box in others])
+                rdist, index = raycast_boxes(bounds.reshape(-1, 4), x, y, np.cos(a), np.sin(a))
+                for i in np.flatnonzero(rdist < dist):
+                    hits[i] = others[index[i]]
+                dist = np.minimum(dist, rdist)
+        for i in np.flatnonzero(dist > max_dist):
+            hits[i] = None
+        dist[dist > max_dist] = inf
+        return dist, hits
+
+    def replan(self):
+        """Plan the current forward move again, after the field changed
+        under it (another robot picked up a rock).
+        """
+        dist = self.dist
+        self.dist = self.curr_move.start
+        self.plan_forward()
+        self.dist = dist
+        self.update_bb()
+
+    def robot_hit(self, dist):
+        """The index box of another robot that this one would run into at
+        distance dist along its current line, or None.
+        """
+        prev = self.dist
+        self.dist = dist
+        self.update_bb()
+        self.dist = prev
+        hit = None
+        with self.stats.timer('collision'):
+            for box in self.robot_index.test_all(self.bbox):
+                if box is not self.index_box:
+                    hit = box
+                    break
+        self.update_bb()
+        return hit
+
+    def update_index(self):
+        if self.robot_index is None:
+            return
+        x, y = self.get_position()
+        if (x, y) != (self.index_box.x, self.index_box.y):
+            self.robot_index.remove_collider(self.index_box)
+            self.index_box.x, self.index_box.y = x, y
+            self.robot_index.add_collider(self.index_box)
+
     def update_bb(self):
         self.bbox.x, self.bbox.y = self.get_position()
 
     def collides(self):
         self.update_bb()
-        return self.collider.test(self.bbox)
+        with self.stats.timer('collision'):
+            return self.collider.test(self.bbox)
 
     def place(self, x, y):
         prev_dist = self.dist
@@ -104,61 +276,54 @@ class InternalRobot:
 
     def update(self):
         if self.curr_move is not None:
-            # Actually do something!
-            if self.curr_move['type'] == 'forward':
-                t0 = self.curr_move['t0']
-                d0 = self.curr_move['start']
-                tgt = self.curr_move['target']
-                spd = self.curr_move['speed']
-
-                dir = 1 if tgt >= d0 else -1
-
-                t = self.tick - t0
-                old_dist = self.dist
-
-                self.dist = d0 + spd * t
-                collision = self.collides()
-                if collision is not None:
-                    # oop, that's bad; jump back
-                    self.dist = old_dist
+            # Actually do something! The outcome of the move was already
+            # worked out when it started, so this just moves the robot along.
+            move = self.curr_move
+            t = self.tick - move.t0
+            stop = move.stop
+            if move.type == 'forward':
+                ended = stop is not None and t >= stop
+                dist = move.end if ended else self.dist_at(t)
+                hit = None
+                if self.robot_index is not None and dist != self.dist:
+                    hit = self.robot_hit(dist)
+                if hit is not None:
+                    # stay where we were on the previous tick, like any
+                    # other collision
+                    self.curr_move_result = MoveResult('forward', False, self.dist - move.start,
+                                                       'collision', hit)
                     self.curr_move = None
-                    self.curr_move_result = {
-                        'type': 'forward',
-                        'success': False,
-                        'error': 'collision',
-                        'collider': collision,
-                        'moved': self.dist - d0
-                    }
-                elif   (dir ==  1 and self.dist >= tgt) \
-                    or (dir == -1 and self.dist <= tgt):
-                    self.dist = tgt
+                elif ended:
+                    self.dist = dist
+                    self.curr_move_result = move.result
                     self.curr_move = None
-                    self.curr_move_result = {
-                        'type': 'forward',
-                        'success': True,
-                        'moved': self.dist - d0
-                    }
-            elif self.curr_move['type'] == 'turn':
+                else:
+                    self.dist = dist
+                self.update_index()
+            elif move.type == 'turn':
                 # turns always succeed
-                t0 = self.curr_move['t0']
-                h0 = self.curr_move['start']
-                tgt = self.curr_move['target']
-                spd = self.curr_move['speed']
-                # print("turn t0=%d h0=%.3f tgt=%.3f spd=%.3f t=%d" % (t0, h0, tgt, spd, self.tick))
+                h0 = move.start
+                tgt = move.target
+                spd = move.speed
+                # print("turn t0=%d h0=%.3f tgt=%.3f spd=%.3f t=%d" % (move.t0, h0, tgt, spd, self.tick))
 
-                dir = 1 if tgt >= h0 else -1
-
-                t = self.tick - t0
-                self.heading = h0 + spd * t
-
-                if    (dir ==  1 and self.heading >= tgt) \
-                   or (dir == -1 and self.heading <= tgt):
+                if stop is None or t < stop:
+                    self.heading = h0 + spd * t
+                else:
                     self.heading = tgt
                     self.curr_move = None
-                    self.curr_move_result = {
-                        'type': 'turn',
-                        'success': True,
-                        'moved': self.heading - h0
-                    }
-                self.image_rotated = pygame.transform.rotate(self.image, degrees(self.heading))
+                    self.curr_move_result = MoveResult('turn', True, self.heading - h0)
             self.tick += 1
+
+    def finish_move(self):
+        """Jump straight to the end of the current move instead of updating
+        tick by tick. Returns the number of ticks that update() would have
+        been called for (0 if there is no move, or if it never ends).
+        """
+        if self.curr_move is None or self.curr_move.stop is None:
+            return 0
+        end = self.curr_move.t0 + self.curr_move.stop
+        skipped = end - self.tick + 1
+        self.tick = end
+        self.update()
+        return skipped
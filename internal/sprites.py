@@ -0,0 +1,181 @@
+# Caches of sprites: rotated copies of the robot, so that drawing a turning
+# robot doesn't need a new rotated surface every frame, and the rock sprites.
+#
+# Generating a rock (internal.field.rock) and converting it from PIL is slow
+# next to everything else at startup, so rock sprites are generated once per
+# radius and seed and packed into an atlas that every MainWindow in the
+# process shares. The atlas can be saved to a file and loaded by later
+# processes, which then don't need PIL at all.
+
+import os
+import random
+from collections import OrderedDict
+from math import degrees
+
+import numpy as np
+import pygame
+
+class SpriteCache:
+    """Rotated copies of sprites, keyed by the sprite and its heading rounded
+    to a multiple of `resolution` degrees. Any number of sprites can share a
+    cache. At most max_size rotated surfaces are kept; the least recently
+    used ones are dropped first.
+    """
+    def __init__(self, resolution=1.0, max_size=2048):
+        self.steps = max(1, round(360 / resolution))
+        self.max_size = max_size
+        self.cache = OrderedDict()
+
+    def key(self, image, heading):
+        return (image, round(degrees(heading) * self.steps / 360) % self.steps)
+
+    def rotate(self, key):
+        image, step = key
+        surf = pygame.transform.rotate(image, step * 360 / self.steps)
+        self.cache[key] = surf
+        if len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+        return surf
+
+    def get(self, image, heading):
+        """Get image rotated to heading (in radians, counterclockwise)."""
+        key = self.key(image, heading)
+        surf = self.cache.get(key)
+        if surf is None:
+            return self.rotate(key)
+        self.cache.move_to_end(key)
+        return surf
+
+    def precompute(self, image):
+        """Render every rotation of image ahead of time."""
+        for step in range(self.steps):
+            if (image, step) not in self.cache:
+                self.rotate((image, step))
+
+def load_pil_image(img):
+    data = img.convert("RGBA").tobytes()
+    surf = pygame.image.fromstring(data, img.size, "RGBA")
+    if pygame.display.get_surface() is None:
+        # headless; there's no display format to convert to
+        return surf
+    return surf.convert_alpha()
+
+def generate_rock(radius, seed):
+    """Make a rock sprite. The generator draws from the random module, which
+    is seeded for it (and put back afterwards) so that the same radius and
+    seed always give the same rock.
+    """
+    from PIL import Image
+    from internal.field import rock
+
+    state = random.getstate()
+    random.seed('rock-%d-%d' % (radius, seed))
+    try:
+        texture = Image.open("internal/field/rock_texture.png")
+        r = rock.Rock(radius, 15, radius/2, texture)
+    finally:
+        random.setstate(state)
+    return load_pil_image(r.image)
+
+class RockAtlas:
+    """Rock sprites packed in rows into one surface. get() returns the area
+    of the surface holding a sprite, generating it first if needed.
+    """
+    # bump this when the rock generator changes, so that old files are ignored
+    VERSION = 1
+
+    def __init__(self, width=512):
+        self.surface = pygame.Surface((width, 64), pygame.SRCALPHA)
+        # (radius, seed) -> pygame.Rect
+        self.rects = {}
+        # where the next sprite goes, and the height of the current row
+        self.x = 0
+        self.y = 0
+        self.row_height = 0
+        # sprites were added since the atlas was last loaded or saved
+        self.dirty = False
+        self.converted = False
+        self.loaded = set()
+
+    def get(self, radius, seed):
+        rect = self.rects.get((radius, seed))
+        if rect is None:
+            rect = self.add((radius, seed), generate_rock(radius, seed))
+        return rect
+
+    def add(self, key, sprite):
+        w, h = sprite.get_size()
+        if self.x + w > self.surface.get_width():
+            self.x = 0
+            self.y += self.row_height
+            self.row_height = 0
+        if self.y + h > self.surface.get_height():
+            self.grow(self.y + h)
+        rect = pygame.Rect(self.x, self.y, w, h)
+        self.surface.blit(sprite, rect, special_flags=pygame.BLEND_RGBA_MAX)
+        self.x += w
+        self.row_height = max(self.row_height, h)
+        self.rects[key] = rect
+        self.dirty = True
+        self.converted = False
+        return rect
+
+    def grow(self, height):
+        new_height = self.surface.get_height()
+        while new_height < height:
+            new_height *= 2
+        surface = pygame.Surface((self.surface.get_width(), new_height), pygame.SRCALPHA)
+        surface.blit(self.surface, (0, 0), special_flags=pygame.BLEND_RGBA_MAX)
+        self.surface = surface
+        self.converted = False
+
+    def prepare(self):
+        """Convert the atlas to the display's format, once there is a display,
+        so that blitting from it is fast.
+        """
+        if not self.converted and pygame.display.get_surface() is not None:
+            self.surface = self.surface.convert_alpha()
+            self.converted = True
+
+    def load(self, path):
+        """Add the sprites in a file written by save() that aren't in the
+        atlas yet. Each file is only read once. Returns False if the file
+        doesn't exist or can't be used.
+        """
+        if path in self.loaded:
+            return True
+        try:
+            with np.load(path) as data:
+                if int(data['version']) != self.VERSION:
+                    return False
+                pixels, keys, rects = data['pixels'], data['keys'], data['rects']
+        except (OSError, ValueError, KeyError):
+            return False
+        image = pygame.image.frombuffer(pixels.tobytes(), pixels.shape[1::-1], "RGBA")
+        dirty = self.dirty
+        for key, rect in zip(keys, rects):
+            key = tuple(int(v) for v in key)
+            if key not in self.rects:
+                self.add(key, image.subsurface(pygame.Rect(*rect)))
+        self.dirty = dirty
+        self.loaded.add(path)
+        return True
+
+    def save(self, path):
+        """Write the atlas to path. Several processes can share the same file;
+        whichever saves last wins.
+        """
+        keys = list(self.rects)
+        pixels = np.frombuffer(pygame.image.tostring(self.surface, "RGBA"), np.uint8)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, version=self.VERSION,
+                     pixels=pixels.reshape(self.surface.get_height(), self.surface.get_width(), 4),
+                     keys=np.array(keys, np.int64).reshape(-1, 2),
+                     rects=np.array([tuple(self.rects[k]) for k in keys], np.int64).reshape(-1, 4))
+        os.replace(tmp, path)
+        self.dirty = False
+        self.loaded.add(path)
+
+# shared by every MainWindow in the process
+rock_atlas = RockAtlas()
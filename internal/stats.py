@@ -0,0 +1,85 @@
+# Timers and counters for the simulation loop.
+
+import json
+import time
+from collections import deque
+
+class Timer:
+    """Context manager that adds the time spent inside it to a Stats."""
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.stats.add(self.name, time.perf_counter() - self.t0)
+
+class Stats:
+    """Rolling timing histograms and counters.
+
+    Timings are kept for the last `window` samples of each name, which is
+    what the percentiles are computed over. Counters count up forever. When
+    disabled, add() and count() do nothing, so the instrumented code costs
+    little more than the perf_counter() calls.
+    """
+    def __init__(self, window=1000, enabled=True):
+        self.window = window
+        self.enabled = enabled
+        self.samples = {}
+        self.totals = {}
+        self.counters = {}
+
+    def add(self, name, seconds):
+        if not self.enabled:
+            return
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples[name] = deque(maxlen=self.window)
+            self.totals[name] = [0, 0.0]
+        samples.append(seconds)
+        total = self.totals[name]
+        total[0] += 1
+        total[1] += seconds
+
+    def timer(self, name):
+        return Timer(self, name)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def timing(self, name):
+        """Summary of a timer, in seconds: p50/p95/p99/max over the window,
+        plus the mean and number of samples over the whole run.
+        """
+        samples = sorted(self.samples.get(name, ()))
+        if len(samples) == 0:
+            return None
+        pick = lambda p: samples[min(len(samples) - 1, int(p * len(samples)))]
+        n, total = self.totals[name]
+        return {'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99),
+                'max': samples[-1], 'mean': total / n, 'count': n}
+
+    def summary(self):
+        return {'timers': {name: self.timing(name) for name in self.samples},
+                'counters': dict(self.counters)}
+
+    def dump(self, path, **extra):
+        """Write summary() (and anything in extra) to a JSON file."""
+        data = dict(extra)
+        data.update(self.summary())
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+
+    def lines(self):
+        """Short text version of the summary, for the on-screen overlay."""
+        out = []
+        for name in sorted(self.samples):
+            t = self.timing(name)
+            out.append("%-10s p50 %6.3f  p95 %6.3f  p99 %6.3f ms" %
+                       (name, t['p50'] * 1000, t['p95'] * 1000, t['p99'] * 1000))
+        for name in sorted(self.counters):
+            out.append("%-16s %d" % (name, self.counters[name]))
+        return out
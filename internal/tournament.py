@@ -0,0 +1,177 @@
+# Run a controller over many seeded fields in parallel and summarize the
+# results.
+
+import importlib
+import json
+import multiprocessing
+import multiprocessing.connection
+import statistics
+import time
+import traceback
+
+def load_controller(name):
+    """Load a controller given as 'module' (which must have a run() function)
+    or 'module:function'.
+    """
+    module, _, fn = name.partition(':')
+    return getattr(importlib.import_module(module), fn or 'run')
+
+def failed_result(seed, error=None, wall_time=None):
+    return {'seed': seed, 'success': False, 'ticks': None, 'wall_time': wall_time,
+            'rocks_left': None, 'collisions': None, 'error': error}
+
+def run_one(controller, seed, max_ticks=None, timeout=None, sprite_cache=None):
+    """Run a single headless simulation and return its results. Never raises;
+    anything that goes wrong is reported in 'error'. Rock sprites are shared
+    between runs through sprite_cache, if it is given.
+    """
+    result = failed_result(seed)
+    try:
+        # imported here so that the parent process never needs pygame
+        from internal import window
+        win = window.MainWindow(load_controller(controller), True, seed=seed,
+                                sprite_cache=sprite_cache)
+        win.start()
+        result.update(win.run(max_ticks, timeout, stop_on_return=True))
+        result['collisions'] = dict(win.driver.collisions)
+    except (Exception, SystemExit):
+        result['error'] = traceback.format_exc(limit=-1).strip().splitlines()[-1]
+    return result
+
+def _run_child(conn, args):
+    conn.send(run_one(*args))
+    conn.close()
+
+def run_tournament(controller, seeds, processes=None, max_ticks=None, timeout=None,
+                   grace=10, sprite_cache=None):
+    """Run controller once for every seed. Each simulation gets a fresh
+    process, and up to `processes` of them (one per CPU by default) run at
+    a time.
+
+    Runs are stopped by the simulator after max_ticks ticks or timeout
+    seconds. As a backstop, a run that hasn't answered grace seconds after
+    that is recorded as hung and its process is killed, making room for the
+    next seed.
+    """
+    processes = processes or multiprocessing.cpu_count()
+    todo = list(reversed(seeds))
+    # receiving end of each run's pipe -> (seed, process, start time)
+    running = {}
+    results = {}
+    try:
+        while todo or running:
+            while todo and len(running) < processes:
+                seed = todo.pop()
+                recv, send = multiprocessing.Pipe(duplex=False)
+                proc = multiprocessing.Process(target=_run_child, daemon=True, args=(
+                        send, (controller, seed, max_ticks, timeout, sprite_cache)))
+                proc.start()
+                # only the child holds the sending end now, so recv() fails
+                # instead of blocking if it dies without answering
+                send.close()
+                running[recv] = (seed, proc, time.time())
+
+            for conn in multiprocessing.connection.wait(list(running), 0.1):
+                seed, proc, t0 = running.pop(conn)
+                try:
+                    results[seed] = conn.recv()
+                except EOFError:
+                    proc.join()
+                    results[seed] = failed_result(seed, 'process exited with code %s' %
+                                                  proc.exitcode, time.time() - t0)
+                conn.close()
+                proc.join()
+
+            if timeout is not None:
+                now = time.time()
+                for conn, (seed, proc, t0) in list(running.items()):
+                    if now - t0 > timeout + grace:
+                        proc.kill()
+                        proc.join()
+                        conn.close()
+                        del running[conn]
+                        results[seed] = failed_result(seed, 'hung', now - t0)
+    finally:
+        for conn, (seed, proc, t0) in running.items():
+            proc.kill()
+            proc.join()
+    return [results[seed] for seed in seeds]
+
+def summarize(results):
+    ok = [r for r in results if r['success']]
+    ticks = [r['ticks'] for r in ok]
+    times = [r['wall_time'] for r in ok]
+    collisions = {'rock': 0, 'robot': 0, 'barrier': 0, 'edge': 0}
+    for r in results:
+        for k, v in (r['collisions'] or {}).items():
+            collisions[k] += v
+    return {
+        'runs': len(results),
+        'cleared': len(ok),
+        'failed': len(results) - len(ok),
+        'timeouts': sum(1 for r in results if r['error'] is not None
+                        and ('timed out' in r['error'] or r['error'] == 'hung')),
+        'ticks_mean': statistics.mean(ticks) if ticks else None,
+        'ticks_median': statistics.median(ticks) if ticks else None,
+        'ticks_max': max(ticks) if ticks else None,
+        'wall_time_mean': statistics.mean(times) if times else None,
+        'collisions': collisions,
+    }
+
+def format_table(results, summary):
+    lines = ["%8s  %-8s %9s %8s %5s %5s %5s %5s  %s" %
+             ('seed', 'result', 'ticks', 'wall(s)', 'left', 'rock', 'barr', 'edge', 'error')]
+    for r in results:
+        c = r['collisions'] or {}
+        lines.append("%8s  %-8s %9s %8s %5s %5s %5s %5s  %s" % (
+            r['seed'], 'cleared' if r['success'] else 'FAILED',
+            '-' if r['ticks'] is None else r['ticks'],
+            '-' if r['wall_time'] is None else '%.2f' % r['wall_time'],
+            '-' if r['rocks_left'] is None else r['rocks_left'],
+            c.get('rock', '-'), c.get('barrier', '-'), c.get('edge', '-'),
+            r['error'] or ''))
+    lines.append('')
+    lines.append("%d/%d cleared, %d timed out" %
+                 (summary['cleared'], summary['runs'], summary['timeouts']))
+    if summary['ticks_mean'] is not None:
+        lines.append("ticks to clear: mean %.1f, median %.1f, max %d" %
+                     (summary['ticks_mean'], summary['ticks_median'], summary['ticks_max']))
+    lines.append("collisions: %(rock)d rock, %(barrier)d barrier, %(edge)d edge" %
+                 summary['collisions'])
+    return '\n'.join(lines)
+
+def parse_seeds(text):
+    """Parse seeds like '0-99' or '1,5,10-12'."""
+    seeds = []
+    for part in text.split(','):
+        lo, sep, hi = part.partition('-')
+        seeds.extend(range(int(lo), int(hi) + 1) if sep else [int(lo)])
+    return seeds
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Run a controller over many seeded fields")
+    parser.add_argument('--controller', default='rockbot.run',
+                        help="controller as module or module:function (default rockbot.run)")
+    parser.add_argument('--seeds', type=parse_seeds, default=parse_seeds('0-15'),
+                        help="seeds to run, e.g. 0-99 or 1,5,10-12 (default 0-15)")
+    parser.add_argument('--processes', type=int, default=None,
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument('--max-ticks', type=int, default=200000,
+                        help="give up on a run after this many ticks")
+    parser.add_argument('--timeout', type=float, default=300,
+                        help="give up on a run after this many seconds")
+    parser.add_argument('--json', default='tournament.json',
+                        help="file to write the results to")
+    parser.add_argument('--sprite-cache', metavar='FILE', default='rock_sprites.npz',
+                        help="file to keep generated rock sprites in between runs")
+    args = parser.parse_args(argv)
+
+    results = run_tournament(args.controller, args.seeds, args.processes,
+                             args.max_ticks, args.timeout, sprite_cache=args.sprite_cache)
+    summary = summarize(results)
+    print(format_table(results, summary))
+    with open(args.json, 'w') as f:
+        json.dump({'controller': args.controller, 'summary': summary, 'runs': results},
+                  f, indent=2)
+    print("Results written to %s" % args.json)
@@ -3,34 +3,41 @@ import random
 import time
 import sys
 import math
+import threading
 
 import pygame
 import numpy as np
 
-from internal.field import rock
 from internal.collision import *
 from internal.driver import Driver
+from internal.sprites import SpriteCache
+from internal.recorder import Recorder
+from internal.stats import Stats
+from internal.world import World, KIND_BARRIER, KIND_ROCK
 
-from internal import robot
+from internal import robot, layout, placement, procdriver, replay, sprites, version
 from external import robot as robot_ex
 
-from PIL import Image
-
-def load_pil_image(img):
-    size = img.size
-    mode = img.mode
-    data = img.tobytes()
-    return pygame.image.fromstring(data, size, "RGBA").convert_alpha()
-
 class InternalRock:
-    def __init__(self, rock):
-        self.image = load_pil_image(rock.image)
-        self.collider = AABB(2*rock.radius, 2*rock.radius, 0, 0)
-        self.collider.info = {'rock': self}
+    __slots__ = ('collider', 'sprite')
+
+    def __init__(self, world, radius, x, y, sprite):
+        # the area of sprites.rock_atlas that the rock is drawn from
+        self.sprite = sprite
+        self.collider = world.add(2*radius, 2*radius, x, y, KIND_ROCK, self)
 
 def thread_fn(driver, robot_fn):
     rbt = robot_ex.Robot(driver)
-    robot_fn(rbt)
+    driver.ready.set()
+    try:
+        robot_fn(rbt)
+    except Exception as e:
+        driver.error = e
+        raise
+
+# longest that run() sleeps at a time while the robots are idle, so that it
+# still handles window events and notices timeouts
+IDLE_WAIT = 0.1
 
 class MainWindow:
     DRAW_DISABLE_ROCKS    = 0x01 # don't draw rocks
@@ -38,127 +45,533 @@ class MainWindow:
     DRAW_DISABLE_PLAYER   = 0x04 # don't draw the player
     DRAW_DISABLE_FLIP     = 0x08 # don't update the screen
 
-    rock_radii = (12, 16, 20)
+    rock_radii = layout.ROCK_RADII
 
-    def __init__(self, robot_fn):
+    def __init__(self, robot_fn, headless=False, collision=None, seed=None,
+                 rock_count=layout.ROCK_COUNT, rock_placement='poisson',
+                 show_stats=False, controller_process=False, log_file=None,
+                 record_file=None, record_scale=1, sprite_cache=None):
+        self.headless = headless
+        # timings and counters for the simulation loop; see internal.stats
+        self.stats = Stats()
+        # draw the stats on top of the field (only on the display; they
+        # don't show up in screenshots or recordings)
+        self.show_stats = show_stats
+        self.font = None
+        # everything random about the field comes from here, so the same seed
+        # always gives the same layout. Without one, pick one that can be
+        # reported so the run can be reproduced.
+        if seed is None:
+            seed = random.randrange(2**32)
+        self.seed = seed
+        self.random = random.Random(seed)
+        if headless:
+            # SDL still wants a video driver for surfaces and image loading,
+            # but there is no need for a real one
+            os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
         # initialize all the pygame modules we'll need
         pygame.display.init()
-        self.width  = 720
-        self.height = 720
+        self.width  = layout.FIELD_WIDTH
+        self.height = layout.FIELD_HEIGHT
+        # number of simulation ticks run so far
+        self.ticks = 0
+        # set by the drivers when a controller sends a command, asks for a
+        # screenshot or finishes, so that run() can sleep while the robots
+        # are idle; see wait_idle()
+        self.wakeup = threading.Event()
+        # fraction of a tick left over from the last idle wait
+        self.idle_ticks = 0
 
-        self.screen = pygame.display.set_mode((self.width, self.height), pygame.SCALED)
+        if headless:
+            # off-screen surface; only drawn to when a screenshot is requested
+            self.screen = pygame.Surface((self.width, self.height))
+        else:
+            self.screen = pygame.display.set_mode((self.width, self.height), pygame.SCALED)
         self.field_bg = pygame.image.load("internal/field/grass.png")
         self.rocks = []
+        # cached background layer, see draw()
+        self.scene = None
+        self.last_flags = 0
+        # where the robots were drawn last frame
+        self.robot_rects = None
 
-        self.collision = CollisionSet()
+        # the barriers and rocks, as arrays; see internal.world
+        self.world = World()
+        for l, t, r, b in layout.BARRIERS:
+            self.world.add(r-l, t-b, (r+l)/2, (t+b)/2, KIND_BARRIER)
+        # any empty CollisionSet will do. The world keeps its own grid (see
+        # internal.world), so this only holds a few other things: the screen
+        # edges, and the robots while the rocks are placed
+        if collision is None:
+            collision = CollisionSet()
+        self.collision = collision
         self.collision.add_collider(ScreenCollider(self.width, self.height))
-        # add barriers here
-
-        # bounding_boxes = [
-        # #              left top right bottom
-        # (0, 110, 528, 160),
-        # (189, 320, 720, 375),
-        # (0, 543, 529, 595)
-        # ]
-
-        self.collision.add_collider(aabb_from_corners(-360, 250,  168, 200))
-        self.collision.add_collider(aabb_from_corners(-171, 40,   360, -15))
-        self.collision.add_collider(aabb_from_corners(-360, -183, 169, -235))
-
-        self.robot = robot.InternalRobot(20, 2, self)
-        self.driver = Driver(self.robot, self.screen, thread_fn, (robot_fn,))
-
-        # set start position
-        robot_start_x = 0
-        robot_start_y = 100
-        if not self.robot.place(robot_start_x, robot_start_y):
-            raise ValueError("Can't place robot at (%.3f, %.3f)" % \
-                        (robot_start_x, robot_start_y))
-
-        # temporarily add the robot collider so we don't put rocks on top of it
-        # We'll remove it after we're done so the robot doesn't have problems
-        # colliding with itself
-        self.robot.update_bb()
-        self.collision.add_collider(self.robot.bbox)
+        self.collision.add_collider(self.world)
+
+        # robot_fn can be a list of controllers, one for each robot
+        robot_fns = list(robot_fn) if isinstance(robot_fn, (list, tuple)) else [robot_fn]
+        if len(robot_fns) > len(layout.ROBOT_STARTS):
+            raise ValueError("At most %d robots fit on the field" % len(layout.ROBOT_STARTS))
+        if log_file is not None and len(robot_fns) > 1:
+            raise ValueError("Command logs only work with a single robot")
+
+        self.robots = []
+        self.drivers = []
+        # picks waiting for resolve_picks() when there are several robots
+        self.pick_requests = []
+        self.robot_index = GridCollisionSet() if len(robot_fns) > 1 else None
+        for i, fn in enumerate(robot_fns):
+            rbt = robot.InternalRobot(layout.ROBOT_RADIUS, layout.ROBOT_SPEED, self, i)
+            if i > 0:
+                rbt.image = self.robots[0].image
+            # with controller_process, the controller runs in a child process
+            # and the driver's thread only relays its commands; see
+            # internal.procdriver
+            drv = Driver(rbt, self.screen,
+                         procdriver.process_thread_fn if controller_process else thread_fn,
+                         (fn,), self.stats, self.wakeup)
+            if self.robot_index is not None:
+                rbt.robot_index = self.robot_index
+                drv.picker = self.pick_requests.append
+            self.robots.append(rbt)
+            self.drivers.append(drv)
+        # the first robot, which is the only one unless there are several
+        # controllers
+        self.robot = self.robots[0]
+        self.driver = self.drivers[0]
+
+        self.sprites = SpriteCache()
+        if not headless:
+            # only a few ms, and saves hiccups during the first turns
+            self.sprites.precompute(self.robot.image)
+        # every command and its result, for internal.replay
+        self.log = None
+        if log_file is not None:
+            self.log = replay.LogWriter(log_file, lambda: self.ticks, seed,
+                                        rock_count, rock_placement)
+            self.driver.log = self.log
+        # records every frame in the background; see internal.recorder
+        self.recorder = None
+        if record_file is not None:
+            self.recorder = Recorder(record_file, self.width, self.height,
+                                     layout.TICK_RATE, record_scale)
+
+        # set start positions
+        for rbt, (robot_start_x, robot_start_y) in zip(self.robots, layout.ROBOT_STARTS):
+            if not rbt.place(robot_start_x, robot_start_y):
+                raise ValueError("Can't place robot at (%.3f, %.3f)" % \
+                            (robot_start_x, robot_start_y))
+            rbt.update_index()
+
+        # temporarily add the robot colliders so we don't put rocks on top of
+        # them. We'll remove them after we're done so the robots don't have
+        # problems colliding with themselves
+        for rbt in self.robots:
+            rbt.update_bb()
+            self.collision.add_collider(rbt.bbox)
         self.rocks = []
-        rock_tex = Image.open("internal/field/rock_texture.png")
-        for i in range(24):
-            rad = self.rock_radii[int(random.random() * len(self.rock_radii))]
-            r = rock.Rock(rad, 15, rad/2, rock_tex)
-            ir = InternalRock(r)
-
-            # place the rock
-            while True:
-                ir.collider.x = int(random.random() * self.width - self.width/2)
-                ir.collider.y = int(random.random() * self.height - self.height/2)
-                collide = self.collision.test(ir.collider)
-                if collide is None:
-                    break
-                # else:
-                #     print("collides with %s" % collide)
-            self.rocks.append(ir)
-            self.collision.add_collider(ir.collider)
-        self.collision.remove_collider(self.robot.bbox)
+        radii = [self.rock_radii[int(self.random.random() * len(self.rock_radii))]
+                 for i in range(rock_count)]
+        if rock_placement == 'poisson':
+            positions = placement.place_poisson(self.random, radii, self.collision,
+                                                self.width, self.height)
+        elif rock_placement == 'uniform':
+            positions = placement.place_uniform(self.random, radii, self.collision,
+                                                self.width, self.height)
+        else:
+            raise ValueError("Unknown rock placement: %s" % rock_placement)
+
+        # which sprite each rock gets; from its own generator so that the
+        # layout doesn't depend on it
+        looks = random.Random('%d-rocks' % seed)
+        atlas = sprites.rock_atlas
+        if sprite_cache is not None:
+            atlas.load(sprite_cache)
+        for rad, (x, y) in zip(radii, positions):
+            sprite = atlas.get(rad, looks.randrange(layout.ROCK_SPRITE_VARIANTS))
+            self.rocks.append(InternalRock(self.world, rad, x, y, sprite))
+        for rbt in self.robots:
+            self.collision.remove_collider(rbt.bbox)
+        if sprite_cache is not None and atlas.dirty:
+            atlas.save(sprite_cache)
 
     def start(self):
-        self.driver.start()
+        for driver in self.drivers:
+            driver.start()
+
+    def idle(self):
+        """True if no robot is moving and no commands are waiting to run."""
+        return all(r.curr_move is None for r in self.robots) \
+                and not any(d.pending() for d in self.drivers)
+
+    def tick(self, screenshot=True):
+        """Run one simulation tick for every robot."""
+        with self.stats.timer('driver'):
+            for driver in self.drivers:
+                driver.update(screenshot)
+            self.resolve_picks()
+        with self.stats.timer('robot'):
+            for rbt in self.robots:
+                rbt.update()
+        self.ticks += 1
+
+    def resolve_picks(self):
+        """Hand out the rocks that robots asked to pick up this tick. A rock
+        in range of several of them goes to the nearest one; exact ties go to
+        each robot in turn, tick by tick.
+        """
+        if len(self.pick_requests) == 0:
+            return
+        # the drivers hold on to this list, so empty it rather than replace it
+        requests = list(self.pick_requests)
+        del self.pick_requests[:]
+        claims = {}
+        for driver in requests:
+            for rock in driver.robot.rocks_in_range():
+                claims.setdefault(rock, []).append(driver.robot)
+        picked = {driver.robot: 0 for driver in requests}
+        n = len(self.robots)
+        for rock, robots in claims.items():
+            winner = min(robots, key=lambda r: (r.rock_distance(rock), (r.index - self.ticks) % n))
+            self.remove_rock(rock)
+            picked[winner] += 1
+        for driver in requests:
+            driver.finish_pick(picked[driver.robot])
 
-    def update(self, flags=0):
+    def update(self, flags=0, steps=1):
+        """Run up to `steps` simulation ticks, then draw a frame. Extra steps
+        are skipped once the robot is idle and no commands are waiting. In
+        headless mode, steps is ignored; one tick (or a whole move) is run and
+        nothing is drawn unless a screenshot is wanted.
+        """
+        t0 = time.perf_counter()
+        stats = self.stats
+        if self.headless and len(self.robots) == 1:
+            # Only render when the driver is going to capture the frame. The
+            # request flag is sampled once so that a request arriving halfway
+            # through this tick can't be served from a stale surface.
+            screenshot = self.driver.screenshot_req
+            if screenshot:
+                self.draw(flags | self.DRAW_DISABLE_FLIP)
+            with stats.timer('driver'):
+                self.driver.update(screenshot)
+            # Nobody can see the robot until its move is over (unless a
+            # screenshot is pending), so jump straight to the end of the move.
+            with stats.timer('robot'):
+                ticks = 0
+                if not self.driver.screenshot_req:
+                    ticks = self.robot.finish_move()
+                if ticks == 0:
+                    self.robot.update()
+                    ticks = 1
+            self.ticks += ticks
+            if self.recorder is not None:
+                self.draw(flags | self.DRAW_DISABLE_FLIP)
+                self.record_frame()
+            stats.add('tick', time.perf_counter() - t0)
+            return
+        elif self.headless:
+            # other robots can get in the way, so moves can't be skipped
+            screenshot = any(d.screenshot_req for d in self.drivers)
+            if screenshot:
+                self.draw(flags | self.DRAW_DISABLE_FLIP)
+            self.tick(screenshot)
+            if self.recorder is not None:
+                self.draw(flags | self.DRAW_DISABLE_FLIP)
+                self.record_frame()
+            stats.add('tick', time.perf_counter() - t0)
+            return
+
+        self.handle_events()
+
+        for i in range(steps):
+            # the screen is only fresh for the first step
+            self.tick(i == 0)
+            if self.idle():
+                # waiting for the controller, which runs in real time
+                break
+        self.draw(flags)
+        if self.recorder is not None:
+            self.record_frame()
+        stats.add('tick', time.perf_counter() - t0)
+
+    def handle_events(self):
         for ev in pygame.event.get():
             if ev.type == pygame.QUIT: sys.exit(0)
 
-        self.driver.update()
-        self.robot.update()
-        self.screen.blit(self.field_bg, (0, 0))
+    def wait_idle(self, timeout):
+        """Sleep until a controller sends a command, asks for a screenshot
+        or finishes, or for timeout seconds. Nothing moves in the meantime,
+        so there is nothing to simulate or draw, but the time still counts:
+        it is added to the tick count at TICK_RATE ticks per second.
+        """
+        t0 = time.perf_counter()
+        self.wakeup.wait(timeout)
+        waited = time.perf_counter() - t0
+        self.stats.add('idle', waited)
+        self.idle_ticks += waited * layout.TICK_RATE
+        ticks = int(self.idle_ticks)
+        self.idle_ticks -= ticks
+        self.ticks += ticks
+        if not self.headless:
+            self.handle_events()
+
+    def record_frame(self):
+        """Hand the frame that was just drawn to the recorder, labelled with
+        what each robot is doing.
+        """
+        with self.stats.timer('record'):
+            if len(self.drivers) == 1:
+                label = self.driver.current_command()
+            else:
+                label = '  '.join('%d: %s' % (i, d.current_command())
+                                  for i, d in enumerate(self.drivers))
+            if not self.recorder.add(self.screen, self.ticks, label):
+                self.stats.count('frames dropped')
 
+    def remove_rock(self, rock):
+        self.world.remove(rock.collider)
+        self.rocks.remove(rock)
+        self.scene = None
+        # the rock may have been in the way of another robot's move
+        for rbt in self.robots:
+            if rbt.curr_move is not None and rbt.curr_move.type == 'forward':
+                rbt.replan()
+
+    def draw_scene(self, flags):
+        """Redraw the cached background layer (grass and rocks)."""
+        self.scene = pygame.Surface((self.width, self.height))
+        if pygame.display.get_surface() is not None:
+            self.scene = self.scene.convert()
+        self.scene.blit(self.field_bg, (0, 0))
         if not (flags & self.DRAW_DISABLE_ROCKS):
-            for r in self.rocks:
-                self.screen.blit(r.image,
-                    (r.collider.l() + self.width/2, self.height/2 - r.collider.t()))
+            atlas = sprites.rock_atlas
+            atlas.prepare()
+            world = self.world
+            slots = world.live(KIND_ROCK)
+            x = world.edges[slots, 0] + self.width/2
+            y = self.height/2 - world.edges[slots, 3]
+            self.scene.blits([(atlas.surface, pos, world.owners[i].sprite)
+                              for i, pos in zip(slots, zip(x.tolist(), y.tolist()))],
+                             doreturn=False)
+
+    def draw(self, flags=0):
+        t0 = time.perf_counter()
+        # Everything but the robots lives in self.scene, which only changes
+        # when a rock is picked up. Normally, only the areas that the robots
+        # covered in the last frame and the areas they cover now need to be
+        # redrawn. The debug overlay is drawn from scratch every frame.
+        overlay = not (flags & self.DRAW_DISABLE_BARRIERS) or self.show_stats
+        full = self.scene is None or flags != self.last_flags \
+                or self.robot_rects is None or overlay
+        if self.scene is None or (flags ^ self.last_flags) & self.DRAW_DISABLE_ROCKS:
+            self.draw_scene(flags)
+        self.last_flags = flags
+
+        if full:
+            self.screen.blit(self.scene, (0, 0))
+            dirty = None
+        else:
+            for rect in self.robot_rects:
+                self.screen.blit(self.scene, rect, rect)
+            dirty = list(self.robot_rects)
+
+        self.robot_rects = None
         if not (flags & self.DRAW_DISABLE_PLAYER):
-            rotated = self.robot.image_rotated
-            rx, ry = self.robot.get_position()
-            x = self.width/2 + rx - rotated.get_width()/2
-            y = self.height/2 - ry - rotated.get_height()/2
-            self.screen.blit(rotated, (x, y))
+            self.robot_rects = []
+            for rbt in self.robots:
+                rotated = self.sprites.get(rbt.image, rbt.heading)
+                rx, ry = rbt.get_position()
+                x = self.width/2 + rx - rotated.get_width()/2
+                y = self.height/2 - ry - rotated.get_height()/2
+                self.robot_rects.append(self.screen.blit(rotated, (x, y)))
+            if dirty is not None:
+                dirty.extend(self.robot_rects)
         if not (flags & self.DRAW_DISABLE_BARRIERS):
             # TODO draw barriers
             self.collision.draw(self.screen, self.width/2, self.height/2)
-            self.robot.bbox.draw(self.screen, self.width/2, self.height/2)
-            rx, ry = self.robot.get_position()
+            for rbt in self.robots:
+                rbt.bbox.draw(self.screen, self.width/2, self.height/2)
+                rx, ry = rbt.get_position()
 
-            pygame.draw.circle(self.screen, (0x00, 0xff, 0x00),
-                        (self.width/2 + rx, self.height/2 - ry), int(self.robot.pick_radius), 1)
-            for rock in self.rocks:
-                pygame.draw.circle(self.screen, (0x00, 0xff, 0xff),
-                        (self.width/2 + rock.collider.x, self.height/2 - rock.collider.y),
-                        int((rock.collider.width/2) * 1.2) , 1)
+                pygame.draw.circle(self.screen, (0x00, 0xff, 0x00),
+                            (self.width/2 + rx, self.height/2 - ry), int(rbt.pick_radius), 1)
+            world = self.world
+            slots = world.live(KIND_ROCK)
+            x = (world.center[slots, 0] + self.width/2).tolist()
+            y = (self.height/2 - world.center[slots, 1]).tolist()
+            r = (world.half[slots, 0] * layout.ROCK_PICK_SCALE).astype(int).tolist()
+            for pos in zip(x, y, r):
+                pygame.draw.circle(self.screen, (0x00, 0xff, 0xff), pos[:2], pos[2], 1)
+
+        # The screen surface is also what screenshots and recordings are
+        # taken from, so the stats only stay on it until it has been shown.
+        under_stats = None
+        if self.show_stats and not (flags & self.DRAW_DISABLE_FLIP):
+            under_stats = self.draw_stats()
+        self.stats.add('render', time.perf_counter() - t0)
 
         if not (flags & self.DRAW_DISABLE_FLIP):
-            pygame.display.flip()
+            with self.stats.timer('flip'):
+                if dirty is None:
+                    pygame.display.flip()
+                else:
+                    pygame.display.update(dirty)
+        if under_stats is not None:
+            self.screen.blit(*under_stats)
+
+    def draw_stats(self):
+        """Draw the stats in the top left corner of the screen. Returns a copy
+        of what was there before and where it goes, to blit it back with.
+        """
+        if self.font is None:
+            pygame.font.init()
+            self.font = pygame.font.Font(None, 18)
+        lines = ["tick %d" % self.ticks] + self.stats.lines()
+        texts = [self.font.render(line, True, (0xff, 0xff, 0xff), (0x00, 0x00, 0x00))
+                 for line in lines]
+        area = pygame.Rect(4, 4, max(text.get_width() for text in texts),
+                           sum(text.get_height() for text in texts))
+        area = area.clip(self.screen.get_rect())
+        under = self.screen.subsurface(area).copy()
+        y = 4
+        for text in texts:
+            self.screen.blit(text, (4, y))
+            y += text.get_height()
+        return under, area
 
     def get_opencv_surface(self):
         return pygame.surfarray.array2d(self.screen)
 
-def main(robot_fn):
-    win = MainWindow(robot_fn)
+    def run(self, max_ticks=None, timeout=None, stop_on_return=False,
+            flags=DRAW_DISABLE_BARRIERS, time_scale=1):
+        """Run the simulation until every rock has been picked up. Unless the
+        window is headless, this is held at 60 fps.
+
+        time_scale runs the simulation faster (or slower) than real time
+        while still drawing at 60 fps, by running several ticks per frame.
+        Moves play out tick for tick exactly the same at any scale.
+
+        While the robots are waiting for their controllers, nothing is
+        simulated or drawn: the loop sleeps until a command or a screenshot
+        request comes in (see wait_idle()), and the time spent waiting is
+        added to the tick count at 60 ticks per second. The time a controller
+        spends thinking costs the same number of ticks at any scale, with or
+        without a window.
+
+        The run is abandoned after max_ticks simulation ticks or timeout
+        seconds, if given. With stop_on_return, it is also abandoned once
+        every controller has returned (or raised) and the robots have
+        stopped. Headless runs always stop then, since nothing can happen
+        after that and there is nobody watching.
+
+        Returns a dict with 'success', 'ticks', 'sim_time' (ticks in seconds
+        at 60 ticks per second), 'wall_time', 'rocks_left' and, for
+        unsuccessful runs, 'error'.
+        """
+        start_time = time.perf_counter()
+        frametime = 1 / layout.TICK_RATE
+        result = {'success': False}
+        # fractional ticks carried over between frames
+        budget = 0
+        while True:
+            t = time.perf_counter()
+            # cleared before looking for work, so a command that arrives in
+            # between still ends the wait
+            self.wakeup.clear()
+            idle = self.idle()
+            if idle and (stop_on_return or self.headless) \
+                    and all(d.finished for d in self.drivers):
+                errors = [d.error for d in self.drivers if d.error is not None]
+                if errors:
+                    result['error'] = 'controller raised %r' % errors[0]
+                else:
+                    result['error'] = 'controller returned'
+                break
+
+            waiting = idle and not any(d.screenshot_req for d in self.drivers)
+            if waiting:
+                wait = IDLE_WAIT
+                if max_ticks is not None:
+                    wait = min(wait, max(0, max_ticks - self.ticks) / layout.TICK_RATE)
+                self.wait_idle(wait)
+                if self.show_stats and not self.headless:
+                    # keep the tick counter moving
+                    self.draw(flags)
+            else:
+                budget += time_scale
+                steps = int(budget)
+                budget -= steps
+                self.update(flags, steps)
+
+            if len(self.rocks) == 0:
+                result['success'] = True
+                break
+            if max_ticks is not None and self.ticks >= max_ticks:
+                result['error'] = 'timed out after %d ticks' % self.ticks
+                break
+            if timeout is not None and t - start_time >= timeout:
+                result['error'] = 'timed out after %.1fs' % (t - start_time)
+                break
+            if self.headless or waiting:
+                continue
+            elapsed = time.perf_counter() - t
+            if elapsed < frametime:
+                time.sleep(frametime - elapsed)
+
+        result['ticks'] = self.ticks
+        result['sim_time'] = self.ticks / layout.TICK_RATE
+        result['wall_time'] = time.perf_counter() - start_time
+        result['rocks_left'] = len(self.rocks)
+        return result
+
+def main(robot_fn, headless=False, max_ticks=None, seed=None, show_stats=False,
+         stats_file=None, time_scale=1, controller_process=False, log_file=None,
+         record_file=None, record_scale=1, sprite_cache=None):
+    """Run the simulator until every rock has been picked up.
+
+    In headless mode, no window is opened, nothing is drawn unless the
+    controller asks for a screenshot, and moves run as fast as possible
+    instead of being held at 60 fps (time the controller spends thinking
+    still counts at 60 ticks per second, as with a window), and the run ends
+    as soon as the controller returns. If max_ticks is given, the run is
+    abandoned after that many simulation ticks. The seed picks the rock
+    layout. Timing stats can be drawn on the screen, and are written to
+    stats_file as JSON at the end of the run if it is given. time_scale
+    speeds up (or slows down) the simulation without changing the frame
+    rate; see MainWindow.run(). With controller_process, the controller runs
+    in its own process instead of a thread (robot_fn must be picklable).
+    If log_file is given, every command and its result is written to it, to
+    be checked later with internal.replay. robot_fn can be a list, to put a
+    robot on the field for each controller in it. If record_file is given,
+    the run is recorded to it (see internal.recorder), downsampled by
+    record_scale. Rock sprites are kept in sprite_cache (see
+    internal.sprites.RockAtlas) if it is given, so that later runs don't
+    need to generate them.
+    """
+    win = MainWindow(robot_fn, headless, seed=seed, show_stats=show_stats,
+                     controller_process=controller_process, log_file=log_file,
+                     record_file=record_file, record_scale=record_scale,
+                     sprite_cache=sprite_cache)
+    print("Seed: %d" % win.seed)
     win.start()
-    start_time = time.perf_counter()
-
-    frametime = 1 / 60
-    # win.robot.forward(250)
-    while True:
-        t = time.perf_counter()
-        win.update(win.DRAW_DISABLE_BARRIERS)
-
-        if len(win.rocks) == 0:
-            print("SUCCESS!")
-            print("Time taken: %.3fs" % (time.perf_counter() - t))
-            sys.exit(0)
-
-        elapsed = time.perf_counter() - t
-        if elapsed < frametime:
-            time.sleep(frametime - elapsed)
+    result = win.run(max_ticks, time_scale=time_scale)
+    if win.log is not None:
+        win.log.close()
+    if win.recorder is not None:
+        win.recorder.close()
+        print("Recorded %d frames to %s (%d dropped)" %
+              (win.recorder.recorded, record_file, win.recorder.dropped))
+    if stats_file is not None:
+        win.stats.dump(stats_file, version=version.VERSION, seed=win.seed, result=result)
+
+    if result['success']:
+        print("SUCCESS!")
+    else:
+        print("FAILED: %s (%d rocks left)" % (result['error'], result['rocks_left']))
+    print("Time taken: %.3fs" % result['wall_time'])
+    print("Simulated ticks: %d (%.1fs of simulated time)" % (result['ticks'], result['sim_time']))
+    sys.exit(0 if result['success'] else 1)
 
 if __name__ == '__main__':
     main()
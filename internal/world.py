@@ -0,0 +1,245 @@
+# The fixed part of the field (barriers and rocks), stored as arrays.
+#
+# Every box has a slot: a row in arrays of centers, half-extents, edges,
+# kinds and alive flags. Work over many boxes at once (sweeps, raycasts,
+# finding rocks in range, drawing) is then a few array operations instead of
+# a loop over Python objects. Slots are never reused; removing a box just
+# clears its alive flag, so slot order is the order the boxes were added in.
+#
+# Every array operation has a fixed cost of a microsecond or so, which is
+# more than testing the handful of boxes near a robot one by one. So that
+# single tests stay cheap, the live boxes are also kept in a uniform grid of
+# slot numbers (like GridCollisionSet), and test() compares their edges as
+# plain floats.
+#
+# Code that deals with one box at a time (collision results, the debug
+# overlay) gets a Box, a small handle that behaves like an AABB.
+
+from math import floor, inf
+
+import numpy as np
+import pygame
+
+from internal.collision import *
+
+KIND_BARRIER = 1
+KIND_ROCK    = 2
+KIND_NAMES   = (None, 'barrier', 'rock')
+
+class Box(AABB):
+    """Handle for the box in slot `slot` of a World. Reading or setting its
+    position goes straight to the World's arrays.
+    """
+    __slots__ = ('world', 'slot')
+
+    def __init__(self, world, slot):
+        self.world = world
+        self.slot = slot
+        self.parent = world
+
+    @property
+    def x(self):
+        return float(self.world.center[self.slot, 0])
+
+    @x.setter
+    def x(self, x):
+        self.world.move(self.slot, x, self.y)
+
+    @property
+    def y(self):
+        return float(self.world.center[self.slot, 1])
+
+    @y.setter
+    def y(self, y):
+        self.world.move(self.slot, self.x, y)
+
+    @property
+    def width(self):
+        return float(self.world.half[self.slot, 0] * 2)
+
+    @property
+    def height(self):
+        return float(self.world.half[self.slot, 1] * 2)
+
+    @property
+    def info(self):
+        # what internal.driver.collider_type() looks at
+        owner = self.world.owners[self.slot]
+        return {KIND_NAMES[self.world.kind[self.slot]]: owner}
+
+    def l(self):
+        return float(self.world.edges[self.slot, 0])
+
+    def b(self):
+        return float(self.world.edges[self.slot, 1])
+
+    def r(self):
+        return float(self.world.edges[self.slot, 2])
+
+    def t(self):
+        return float(self.world.edges[self.slot, 3])
+
+class World(Collider):
+    """Barriers and rocks as one collider. test() returns the first box that
+    was added among the ones that intersect, like a CollisionSet holding the
+    same boxes would.
+    """
+    def __init__(self, capacity=64, cell_size=64):
+        super().__init__()
+        self.count = 0
+        self.center = np.zeros((capacity, 2))
+        self.half   = np.zeros((capacity, 2))
+        self.edges  = np.zeros((capacity, 4)) # l, b, r, t
+        self.kind   = np.zeros(capacity, np.uint8)
+        self.alive  = np.zeros(capacity, bool)
+        # live() for each kind, until something changes
+        self.live_cache = {}
+        # grid cell -> slots of the live boxes that overlap it
+        self.cell_size = cell_size
+        self.cells = {}
+        # for each slot, its edges as a tuple of floats (for test()), its
+        # Box, and the object it belongs to (e.g. an InternalRock) or None
+        self.bounds = []
+        self.handles = []
+        self.owners = []
+
+    def grow(self):
+        n = 2 * len(self.kind)
+        for name in ('center', 'half', 'edges', 'kind', 'alive'):
+            old = getattr(self, name)
+            new = np.zeros((n,) + old.shape[1:], old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def add(self, w, h, x, y, kind, owner=None):
+        """Add a w by h box centered on (x, y). Returns its Box."""
+        if self.count == len(self.kind):
+            self.grow()
+        i = self.count
+        self.count += 1
+        self.half[i] = (w/2, h/2)
+        self.kind[i] = kind
+        self.alive[i] = True
+        self.bounds.append(None)
+        self.move(i, x, y)
+        box = Box(self, i)
+        self.handles.append(box)
+        self.owners.append(owner)
+        return box
+
+    def cell_range(self, l, b, r, t):
+        cs = self.cell_size
+        return (range(floor(l / cs), floor(r / cs) + 1),
+                range(floor(b / cs), floor(t / cs) + 1))
+
+    def index(self, slot, add):
+        """Add slot to (or remove it from) the grid cells it overlaps."""
+        xs, ys = self.cell_range(*self.bounds[slot])
+        for i in xs:
+            for j in ys:
+                if add:
+                    self.cells.setdefault((i, j), []).append(slot)
+                else:
+                    cell = self.cells[(i, j)]
+                    cell.remove(slot)
+                    if len(cell) == 0:
+                        del self.cells[(i, j)]
+
+    def move(self, slot, x, y):
+        live = self.alive[slot]
+        if live and self.bounds[slot] is not None:
+            self.index(slot, False)
+        hw, hh = self.half[slot]
+        self.center[slot] = (x, y)
+        self.edges[slot] = (x - hw, y - hh, x + hw, y + hh)
+        self.bounds[slot] = tuple(self.edges[slot].tolist())
+        if live:
+            self.index(slot, True)
+        self.changed()
+
+    def remove(self, box):
+        if not self.alive[box.slot]:
+            return
+        self.index(box.slot, False)
+        self.alive[box.slot] = False
+        self.changed()
+
+    def changed(self):
+        self.live_cache.clear()
+        # CollisionSet keeps the boxes in a cache for raycast()
+        if self.parent is not None:
+            self.parent.box_cache = None
+
+    def live(self, kind=None):
+        """Slots of the boxes still on the field (only those of one kind if
+        it is given), in the order they were added.
+        """
+        slots = self.live_cache.get(kind)
+        if slots is None:
+            n = self.count
+            if kind is None:
+                slots = np.flatnonzero(self.alive[:n])
+            else:
+                slots = np.flatnonzero(self.alive[:n] & (self.kind[:n] == kind))
+            self.live_cache[kind] = slots
+        return slots
+
+    def overlaps(self, aabb):
+        """Slots of the boxes that overlap aabb, in no particular order."""
+        l, b, r, t = aabb.l(), aabb.b(), aabb.r(), aabb.t()
+        bounds = self.bounds
+        hits = set()
+        xs, ys = self.cell_range(l, b, r, t)
+        for i in xs:
+            for j in ys:
+                for slot in self.cells.get((i, j), ()):
+                    bl, bb, br, bt = bounds[slot]
+                    if bl < r and bb < t and br > l and bt > b:
+                        hits.add(slot)
+        return hits
+
+    def test(self, other):
+        # same as min(self.overlaps(other)), but this is the hot path
+        l, b, r, t = other.l(), other.b(), other.r(), other.t()
+        bounds = self.bounds
+        first = None
+        xs, ys = self.cell_range(l, b, r, t)
+        for i in xs:
+            for j in ys:
+                for slot in self.cells.get((i, j), ()):
+                    if first is not None and slot >= first:
+                        continue
+                    bl, bb, br, bt = bounds[slot]
+                    if bl < r and bb < t and br > l and bt > b:
+                        first = slot
+        return None if first is None else self.handles[first]
+
+    def test_all(self, other):
+        return [self.handles[i] for i in sorted(self.overlaps(other))]
+
+    def sweep(self, aabb, dx, dy, dist):
+        if dist == inf:
+            return sweep_boxes(self.edges[self.live()], aabb, dx, dy, dist)
+        ex, ey = dx * dist, dy * dist
+        xs, ys = self.cell_range(aabb.l() + min(ex, 0), aabb.b() + min(ey, 0),
+                                 aabb.r() + max(ex, 0), aabb.t() + max(ey, 0))
+        slots = set()
+        for i in xs:
+            for j in ys:
+                slots.update(self.cells.get((i, j), ()))
+        return sweep_boxes(self.edges[list(slots)], aabb, dx, dy, dist)
+
+    def boxes(self):
+        live = self.live()
+        return [self.handles[i] for i in live], self.edges[live]
+
+    def raycast(self, ox, oy, dx, dy):
+        boxes, bounds = self.boxes()
+        dist, index = raycast_boxes(bounds, ox, oy, dx, dy)
+        return dist, [boxes[i] if i >= 0 else None for i in index]
+
+    def draw(self, surf, x0, y0):
+        for i in self.live():
+            l, b, r, t = self.edges[i]
+            pygame.draw.rect(surf, (0xff, 0x00, 0x00),
+                             pygame.Rect(x0 + l, y0 - t, r - l, t - b), 1)
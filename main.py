@@ -1,6 +1,41 @@
+import argparse
+
 from internal import window, version
 from rockbot.run import run
 
-print("Rockbot Challenge v%s" % version.VERSION)
+parser = argparse.ArgumentParser(description="Rockbot Challenge simulator")
+parser.add_argument('--headless', action='store_true',
+                    help="run without a window, as fast as possible")
+parser.add_argument('--max-ticks', type=int, default=None,
+                    help="give up after this many simulation ticks")
+parser.add_argument('--seed', type=int, default=None,
+                    help="seed for the rock layout")
+parser.add_argument('--show-stats', action='store_true',
+                    help="draw timing stats on the screen")
+parser.add_argument('--stats', metavar='FILE', default=None,
+                    help="write timing stats to FILE as JSON at the end of the run")
+parser.add_argument('--time-scale', type=float, default=1,
+                    help="run the simulation this many times faster than real time")
+parser.add_argument('--log', metavar='FILE', default=None,
+                    help="record every command and its result to FILE (see replay.py)")
+parser.add_argument('--record', metavar='FILE', default=None,
+                    help="record the run to FILE (.avi/.mp4/.mkv for a video)")
+parser.add_argument('--record-scale', type=int, default=1,
+                    help="only record every Nth pixel in each direction")
+parser.add_argument('--robots', type=int, default=1,
+                    help="put this many robots on the field, each running its own copy of run()")
+parser.add_argument('--process', action='store_true',
+                    help="run the controller in its own process instead of a thread")
+parser.add_argument('--sprite-cache', metavar='FILE', default=None,
+                    help="keep generated rock sprites in FILE for later runs")
+
+# the controller process imports this module again, so only run from here
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    print("Rockbot Challenge v%s" % version.VERSION)
 
-window.main(run)
+    robot_fn = [run] * args.robots if args.robots > 1 else run
+    window.main(robot_fn, args.headless, args.max_ticks, args.seed, args.show_stats,
+                args.stats, args.time_scale, args.process, args.log,
+                args.record, args.record_scale, args.sprite_cache)
@@ -0,0 +1,7 @@
+import sys
+
+from internal import replay, version
+
+if __name__ == '__main__':
+    print("Rockbot Challenge v%s replay" % version.VERSION)
+    sys.exit(replay.main())
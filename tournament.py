@@ -0,0 +1,5 @@
+from internal import tournament, version
+
+if __name__ == '__main__':
+    print("Rockbot Challenge v%s tournament" % version.VERSION)
+    tournament.main()